@@ -1,6 +1,7 @@
 from PIL import ImageTk, Image
 from typing import Tuple, List, Union
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date, timedelta
 import numpy as np
 import pandas as pd
@@ -9,10 +10,80 @@ import tqdm
 from Institution import Institution
 from RiskManager import RiskManager
 from LinearProgramming import SelectCandidatesForTest
+from GreedySelection import nested_greedy_ordering, GreedySelectCandidatesForTest
 from MyDate import check_strdate, MyDate
 from Util.plot import plot_budget_exploration
-from Util.spreadsheet import merge_checklist_to_main, read_main_spreadsheet, produce_checklist, produce_weighted_risk_sheet
-from shutil import copyfile
+from Util.cache import SolutionCache, content_hash
+from Util.journal import TestJournal
+from Util.spreadsheet import read_main_spreadsheet, read_deferred_main_spreadsheet, record_checklists_to_journal, \
+    list_dated_spreadsheets, write_main_spreadsheet, write_main_spreadsheet_sidecar, produce_checklist, \
+    produce_weighted_risk_sheet
+
+
+def solve_budget(problem: SelectCandidatesForTest, B: int, current_date: MyDate, solver_path: str) -> Union[dict, None]:
+    """
+    Solves the people selection for a single budget, and computes the weights of the people and of the groups
+    as if the selected people were tested right away.
+    :param problem: SelectCandidatesForTest, whose budget will be set to B
+    :param B: integer, the budget
+    :param current_date: the date at which the selected people are tested
+    :param solver_path: a path to the solver executable (only used by the "glpk" solver backend)
+    :return: a dictionary with the sampled_person_lst, sampled_groups_lst, wV, wE, solver_iterations, solver_gap
+             (relative gap of the selection from the best bound, None if unknown) and time_limit_reached entries,
+             or None if the solver failed
+    """
+    problem.set_budget(B)
+    sampled_person_lst = problem.solve(path=solver_path, verbosity=0)
+    if sampled_person_lst is None:
+        return None
+    return budget_solution(problem.institution, sampled_person_lst, current_date,
+                           solver_iterations=problem.solver_iterations,
+                           solver_gap=problem.solution_gap,
+                           time_limit_reached=problem.status() == 2)
+
+
+def budget_solution(institution: Institution, sampled_person_lst: list, current_date: MyDate, **extra_entries) -> dict:
+    """
+    Computes the weights of the people and of the groups as if the selected people were tested right away.
+    :param institution: the institution from which the people were selected (remains unchanged)
+    :param sampled_person_lst: list (of strings) of the people selected for testing
+    :param current_date: the date at which the selected people are tested
+    :param extra_entries: additional entries for the solution dictionary
+    :return: a dictionary with the sampled_person_lst, sampled_groups_lst, wV and wE entries (and the extra_entries)
+    """
+    sampled_groups_lst = institution.get_groups_of_people(sampled_person_lst, format="list")
+
+    # mark the selected people as if they were tested right away - on a copy of the institution,
+    # so that the weight updates of this budget do not affect the selections of the other budgets.
+    tested_institution = institution.copy()
+    tested_institution.update_test_date(sampled_person_lst, current_date)
+    tested_institution.update_weights(current_date)
+
+    # record history
+    # tested_institution.draw(node_size=100, marked_nodes=sampled_person_lst+sampled_groups_lst,
+    #                       output_dir=self.fig_output_dir,
+    #                       output_filename="Graph_B_{}".format(B),
+    #                       output_type="png", figsize=(8, 12), margins=(0.05, 0.21), font_size=6)
+    return dict(sampled_person_lst=sampled_person_lst,
+                sampled_groups_lst=sampled_groups_lst,
+                wV=tested_institution.w.astype(np.float32),
+                wE=tested_institution.wE.astype(np.float32),
+                **extra_entries)
+
+
+# The problem of a budget-sweep worker process (built once per process by _init_budget_worker)
+_budget_worker_problem = None
+
+
+def _init_budget_worker(organization_df: pd.DataFrame, risk_df: pd.DataFrame, current_date: MyDate,
+                        risk_manager: RiskManager, problem_kwargs: dict):
+    global _budget_worker_problem
+    institution = Institution(organization_df, risk_df, current_date, risk_manager)
+    _budget_worker_problem = SelectCandidatesForTest(B=0, institution=institution, **problem_kwargs)
+
+
+def _solve_budget_in_worker(B: int, current_date: MyDate, solver_path: str) -> Tuple[int, Union[dict, None]]:
+    return B, solve_budget(_budget_worker_problem, B, current_date, solver_path)
 
 
 class Control:
@@ -32,9 +103,21 @@ class Control:
         self.state = "Init"
         self.message = "Please set the dates for which you wish to perform smart candidate " \
                        "selection. Then click 'Load Spreadsheet'."
-        self.main_spreadsheet_path = ""
+        self.main_spreadsheet_path = ""  # might not be written yet, c.f. spreadsheet_file_setup
+        self.test_journal = TestJournal(os.path.join(self.spreadsheet_directory, "test_journal.sqlite"))
+        self.solver_backend = "highs"  # in-process solver, c.f. SolverBackends.make_solver_backend
+        self.lp_formulation = "matrix"  # c.f. SelectCandidatesForTest
+        self.lp_presolve = True  # collapse interchangeable people into counted variables, c.f. SelectCandidatesForTest
+        self.rounding_trials = 16  # randomized roundings per budget, of which the best is kept
+        self.rounding_seed = 0  # seed of the randomized rounding (None --> a different selection on every solve)
+        self.lazy_constraints = 0  # > 0 --> constraint generation over the groups, c.f. SelectCandidatesForTest
+        self.time_limit = None  # wall-clock limit (in seconds) per budget, None --> unlimited
+        self.mip_rel_gap = None  # relative gap at which integer programs may stop, None --> the solver's default
+        self.num_workers = 1  # number of processes solving the budgets of a sweep in parallel
+        self.budget_exploration = "lp"  # "lp" - an LP per budget, "nested" - c.f. iterate_nested_budget_solutions
+        self.solution_cache = SolutionCache(os.path.join(self.root, "Cache", "solutions"))  # c.f. solution_cache_keys
         self.solver_path = os.path.join(self.root,
-                                        "Solvers/glpk-4.65/w64/glpsol.exe")
+                                        "Solvers/glpk-4.65/w64/glpsol.exe")  # used by the "glpk" solver backend
 
         # When spreadsheet succeeds to load - (self.state = Initial_main_spreadsheet_loaded)
         # the following values should become non-None:
@@ -54,8 +137,14 @@ class Control:
         self.state, self.message, self.main_spreadsheet_path = self.spreadsheet_file_setup(
             current_date, previous_date)
         if "Initial_main_spreadsheet_ready" in self.state:
-            self.organization_df, self.risk_df, spreadsheet_loading_msg = read_main_spreadsheet(
-                self.main_spreadsheet_path)
+            if os.path.exists(self.main_spreadsheet_path):
+                self.organization_df, self.risk_df, spreadsheet_loading_msg = read_main_spreadsheet(
+                    self.main_spreadsheet_path)
+            else:  # a deferred main spreadsheet, c.f. spreadsheet_file_setup
+                self.organization_df, self.risk_df, spreadsheet_loading_msg, warning_msg = \
+                    read_deferred_main_spreadsheet(current_date, self.test_journal)
+                if warning_msg != "":
+                    self.message += "\n\n{}".format(warning_msg)
 
             if spreadsheet_loading_msg != "":
                 self.message += "\n\n{}".format(spreadsheet_loading_msg)
@@ -67,8 +156,10 @@ class Control:
 
     def spreadsheet_file_setup(self, current_date: MyDate, previous_date: MyDate) -> Tuple[str, str, str]:
         """
-        Review the state of the current main spreadsheet, create it if required (by merging the previous main + checklist)
-        or by copying the previous main spreadsheet if the previous checklist is missing.
+        Review the state of the current main spreadsheet, set it up if required (by logging the checklists since the
+        latest main spreadsheet to the test journal, on top of that main spreadsheet - so several missed days are
+        caught up at once) - the set up main spreadsheet is only written upon solving or exporting, c.f.
+        read_deferred_main_spreadsheet.
         This will determine which initial window will be shown
         :return: state, message, main_spreadsheet_path - three strings
         that describe the state of the main spreadsheet of the current date.
@@ -82,14 +173,6 @@ class Control:
             self.spreadsheet_directory, current_date_str + "_main.xlsx")
         odt_current_main_path = os.path.join(
             self.spreadsheet_directory, current_date_str + "_main.odt")
-        xlsx_previous_main_path = os.path.join(
-            self.spreadsheet_directory, previous_date_str + "_main.xlsx")
-        odt_previous_main_path = os.path.join(
-            self.spreadsheet_directory, previous_date_str + "_main.odt")
-        xlsx_previous_checklist_path = os.path.join(
-            self.spreadsheet_directory, previous_date_str + "_checklist.xlsx")
-        odt_previous_checklist_path = os.path.join(
-            self.spreadsheet_directory, previous_date_str + "_checklist.odt")
         xlsx_curr_main_exists, odt_curr_main_exists = os.path.exists(
             xlsx_current_main_path), os.path.exists(odt_current_main_path)
 
@@ -107,136 +190,208 @@ class Control:
             main_spreadsheet_path = xlsx_current_main_path if xlsx_curr_main_exists else odt_current_main_path
         else:
             # If reached here, there is no main spreadsheet for the current day!
-            # Attempt to create it from the previous days (by copying from previous
-            # main or merging previous main + checklist).
-            xlsx_prev_main_exists, odt_prev_main_exists = os.path.exists(
-                xlsx_previous_main_path), os.path.exists(odt_previous_main_path)
-            xlsx_prev_checklist_exists, odt_prev_checklist_exists = os.path.exists(
-                xlsx_previous_checklist_path), os.path.exists(odt_previous_checklist_path)
-            if not(xlsx_prev_main_exists or odt_prev_main_exists):
+            # Attempt to set it up from the previous days, catching up on all the days since the latest main
+            # spreadsheet (up to the previous date): the current main spreadsheet is deferred - it consists of that
+            # main spreadsheet, updated by the tests of the checklists since its date, which are logged in the test
+            # journal. It is only written upon solving or exporting (c.f. export_main_spreadsheet).
+            main_path_dict = list_dated_spreadsheets(self.spreadsheet_directory, "main")
+            checklist_path_dict = list_dated_spreadsheets(self.spreadsheet_directory, "checklist")
+            base_date_str = max((date_str for date_str in main_path_dict if date_str <= previous_date_str),
+                                default=None)
+            checklist_date_str_lst = [] if base_date_str is None else \
+                sorted(date_str for date_str in checklist_path_dict if base_date_str <= date_str <= previous_date_str)
+            ambiguous_checklist_date_str_lst = [date_str for date_str in checklist_date_str_lst
+                                                if len(checklist_path_dict[date_str]) > 1]
+            if base_date_str is None:
                 state = "Initial_main_spreadsheet_missing_both_current_and_previous"
-                message = "No main spreadsheet found for the current date ({}) or the previous date ({}). " \
-                          "Please make sure you have at least one of these two spreadsheets, " \
+                message = "No main spreadsheet found for the current date ({}) or the previous date ({}) or " \
+                          "any date before it. Please make sure you have at least one of these spreadsheets, " \
                           "then click 'Load Spreadsheet'.".format(
                               current_date_str, previous_date_str)
                 main_spreadsheet_path = ""
-            elif xlsx_prev_main_exists and odt_prev_main_exists:
+            elif len(main_path_dict[base_date_str]) > 1:
                 state = "Initial_main_spreadsheet_missing_ambiguity_previous_main"
                 message = "No main spreadsheet found for the current date ({}). While attempting to" \
                           "produce a new current main spreadsheet, the program ran into an ambiguity: " \
                           "Both xlsx and odt main spreadsheets exist for the previous date ({}). " \
                           "Please keep only one of them, then click " \
                           "'Load Spreadsheet'.".format(
-                              current_date_str, previous_date_str)
+                              current_date_str, base_date_str)
+                main_spreadsheet_path = ""
+            elif len(ambiguous_checklist_date_str_lst) > 0:
+                state = "Initial_main_spreadsheet_missing_ambiguity_previous_checklist"
+                message = "No main spreadsheet found for the current date ({}). While attempting to" \
+                          "produce a new current main spreadsheet, the program ran into an ambiguity: "\
+                          "Both xlsx and odt spreadsheets exist for the previous date ({}) checklist. " \
+                          "Please keep only one of them, then click 'Load Spreadsheet'.".format(
+                              current_date_str, ", ".join(ambiguous_checklist_date_str_lst))
                 main_spreadsheet_path = ""
             else:
-                # If reached here, the path to the previous main file is well known.
-                # It is now left to determine whether the checklist file will be available as well.
-                prev_main_path = xlsx_previous_main_path if xlsx_prev_main_exists else odt_previous_main_path
-                if not (xlsx_prev_checklist_exists or odt_prev_checklist_exists):
+                # If reached here, the path to the (written) main file on which the current main file is based
+                # is well known, and so are the paths to the checklist files since its date.
+                base_main_path = main_path_dict[base_date_str][0]
+                main_spreadsheet_path = xlsx_current_main_path if base_main_path.endswith("xlsx") else odt_current_main_path
+                prev_checklist_path_lst = [checklist_path_dict[date_str][0] for date_str in checklist_date_str_lst]
+                if len(prev_checklist_path_lst) == 0:
                     state = "Initial_main_spreadsheet_ready_after_copying_from_prev_main"
                     message = "No main spreadsheet found for the current ({}) date. Since " \
                               "there is no checklist spreadsheet for the previous date ({}), " \
-                              "the current main file was created as an exact copy of the previous main " \
-                              "file.".format(current_date_str,
-                                             previous_date_str)
-                    main_spreadsheet_path = xlsx_current_main_path if xlsx_prev_main_exists else odt_current_main_path
-                    copyfile(
-                        xlsx_previous_main_path if xlsx_prev_main_exists else odt_previous_main_path, main_spreadsheet_path)
-                elif xlsx_prev_checklist_exists and odt_prev_checklist_exists:
-                    state = "Initial_main_spreadsheet_missing_ambiguity_previous_checklist"
-                    message = "No main spreadsheet found for the current date ({}). While attempting to" \
-                              "produce a new current main spreadsheet, the program ran into an ambiguity: "\
-                              "Both xlsx and odt spreadsheets exist for the previous date ({}) checklist. " \
-                              "Please keep only one of them, then click 'Load Spreadsheet'.".format(
-                                  current_date_str, previous_date_str)
-                    main_spreadsheet_path = ""
+                              "the current main file is the same as the previous main " \
+                              "file ({}).".format(current_date_str,
+                                                  previous_date_str if base_date_str == previous_date_str else
+                                                  "or any date since " + base_date_str,
+                                                  base_main_path)
+                    self.test_journal.defer_main(current_date, base_main_path)
                 else:
-                    # At this point the path to the previous main file is well known.
-                    #           and the path to the previous checklist file is well known
-                    prev_checklist_path = xlsx_previous_checklist_path if xlsx_prev_main_exists else odt_previous_checklist_path
                     state = "Initial_main_spreadsheet_ready_after_merge"
                     message = "The current main spreadsheet was successfully created by " \
                               "merging {} with {}. ".format(
-                                  prev_main_path, prev_checklist_path)
-                    main_spreadsheet_path = xlsx_current_main_path if xlsx_previous_main_path else odt_current_main_path
-                    merge_succeeded, merge_errmsg = merge_checklist_to_main(
-                        prev_checklist_path, prev_main_path, main_spreadsheet_path)
-                    message = message + "\n\n" + merge_errmsg if merge_errmsg != "" else message
-                    if not merge_succeeded:
+                                  base_main_path, ", ".join(prev_checklist_path_lst))
+                    merge_succeeded, merge_errmsg = record_checklists_to_journal(prev_checklist_path_lst,
+                                                                                 self.test_journal)
+                    if merge_succeeded:
+                        self.test_journal.defer_main(current_date, base_main_path)
+                    else:
                         state = "Initial_main_spreadsheet_missing_merge_failed"
                         message = "The current main spreadsheet couldn't be created by merging " \
                                   " {} with {}. Please try removing the checklist, clicking 'Load Spreadsheet' " \
                                   "and then once the new current main spreadsheet is ready - update" \
                                   "the tested people via a manual editing of the spreadsheet and relaunching this app." \
-                                  "".format(prev_main_path,
-                                            prev_checklist_path)
+                                  "\n\n{}".format(base_main_path,
+                                                  ", ".join(prev_checklist_path_lst), merge_errmsg)
                         main_spreadsheet_path = ""
 
         return state, message, main_spreadsheet_path
 
     def solve(self, Bmin=2, Bmax=6, integer_programming=False,
-              normalized_coverage=True, secondary_objective_coefficient=0.01, risk_manager=None) -> Tuple[bool, str]:
+              normalized_coverage=True, secondary_objective_coefficient=0.01, risk_manager=None,
+              num_workers=None, budget_exploration=None, report_deviation=False,
+              time_limit=None, mip_rel_gap=None) -> Tuple[bool, str]:
         """
         Solve the people selection for every natural budget B in the range [Bmin, Bmax]
         Gather a solution to each such B under self.solution_dictionary[B].
         :param Bmin: integer, a budget to start from
         :param Bmax: integer, a maximum budget to consider
-        :param progress_widget -  a tk label, which can receive text updates, or None - then just ignore it
+        :param num_workers: integer, number of processes to solve the budgets in parallel (None --> self.num_workers).
+                            The solutions are gathered as soon as each of them is ready.
+        :param budget_exploration: "lp" --> the problem is solved for every budget separately.
+                                   "nested" --> the selections of all the budgets are obtained by a single greedy
+                                                ordering of the people (much faster, c.f. iterate_nested_budget_solutions)
+                                   "greedy" --> every budget is selected by GreedySelection.GreedySelectCandidatesForTest,
+                                                which also reports an upper bound on the optimal objective and the
+                                                optimality gap of its selection (c.f. iterate_greedy_budget_solutions)
+                                   None --> self.budget_exploration
+        :param report_deviation: True --> (only for the "nested" exploration) the problem is also solved for every budget,
+                                 and the deviation of the nested selections from the LP selections is reported.
+        :param time_limit: wall-clock limit (in seconds) of the solve of each budget (None --> self.time_limit).
+                           A budget whose solve hits the limit gets the best selection found so far, and the gap of
+                           that selection is reported.
+        :param mip_rel_gap: relative gap at which the integer program of each budget may stop
+                            (None --> self.mip_rel_gap)
         :return: a tuple with a boolean indicating the success, and a string carrying an
                  error message if necessary
         """
         if self.state == "Initial_main_spreadsheet_loaded":
+            num_workers = self.num_workers if num_workers is None else num_workers
+            budget_exploration = self.budget_exploration if budget_exploration is None else budget_exploration
+            time_limit = self.time_limit if time_limit is None else time_limit
+            mip_rel_gap = self.mip_rel_gap if mip_rel_gap is None else mip_rel_gap
+            allowed_budget_explorations = ["lp", "nested", "greedy"]
+            if budget_exploration not in allowed_budget_explorations:
+                raise TypeError("For the budget exploration the only acceptable values are {}. "
+                                "Given:{}".format(allowed_budget_explorations, budget_exploration))
             self.solutions_dictionary = {}
             self.fig_output_dir = os.path.join(self.root, "Figures", self.current_date.strdate)
             self.progress = (0, Bmax + 1 - Bmin)
-            pbar = tqdm.tqdm(total=Bmax + 1 - Bmin)
+            # The weights and the group constraints are identical for all the budgets, hence both the
+            # institution and the linear program are built once, and only the budget is changed per B.
+            self.institution = Institution(self.organization_df, self.risk_df, self.current_date, risk_manager)
             ws_success, msg = produce_weighted_risk_sheet(self.organization_df, self.risk_df,
                                                           self.main_spreadsheet_path,
-                                                          Institution(self.organization_df, self.risk_df,
-                                                                      self.current_date, risk_manager))
-            for B in range(Bmin, Bmax + 1):
-                pbar.set_description()
-                pbar.update(1)
-
-                self.progress = (lambda x: (x[0]+1, x[1]))(self.progress)
-                # New Institution including weight calculation and discounting - important to create a new
-                # instance to override the weight updates performed by the previous budget selections.
-                self.institution = Institution(
-                    self.organization_df, self.risk_df, self.current_date, risk_manager)
-                problem = SelectCandidatesForTest(B=B, institution=self.institution,
-                                                  integer_programming=integer_programming,
-                                                  normalized_coverage=normalized_coverage,
-                                                  secondary_objective_coefficient=secondary_objective_coefficient)
-                sampled_person_lst = problem.solve(
-                    path=self.solver_path, verbosity=0)
-                if sampled_person_lst is None:
-                    msg += "Solver failed while solving B={}".format(B)
-                    self.solutions_dictionary = None
-                    self.fig_output_dir = None
-                    self.state = "Initial_main_spreadsheet_loaded"
-                    self.message = msg
-                    return False, msg
-                sampled_groups_lst = self.institution.get_groups_of_people(
-                    sampled_person_lst, format="list")
-
-                # mark the selected people as if they were tested right away
-                self.institution.update_test_date(
-                    sampled_person_lst, self.current_date)
-                self.institution.update_weights(self.current_date)
-
-                # record history
-                # self.institution.draw(node_size=100, marked_nodes=sampled_person_lst+sampled_groups_lst,
-                #                       output_dir=self.fig_output_dir,
-                #                       output_filename="Graph_B_{}".format(B),
-                #                       output_type="png", figsize=(8, 12), margins=(0.05, 0.21), font_size=6)
-                self.solutions_dictionary[B] = dict(sampled_person_lst=sampled_person_lst,
-                                                    sampled_groups_lst=sampled_groups_lst,
-                                                    wV=np.array([self.institution.nodes_attributes[person]['w'] for person in
-                                                                 self.institution.person_lst], dtype=np.float32),
-                                                    wE=np.array([self.institution.nodes_attributes[group]['w'] for group in
-                                                                 self.institution.group_lst], dtype=np.float32))
-            pbar.close()
+                                                          self.institution)
+            problem_kwargs = dict(integer_programming=integer_programming,
+                                  normalized_coverage=normalized_coverage,
+                                  secondary_objective_coefficient=secondary_objective_coefficient,
+                                  solver_backend=self.solver_backend,
+                                  formulation=self.lp_formulation,
+                                  presolve=self.lp_presolve,
+                                  rounding_trials=self.rounding_trials,
+                                  rounding_seed=self.rounding_seed,
+                                  lazy_constraints=self.lazy_constraints,
+                                  time_limit=time_limit,
+                                  mip_rel_gap=mip_rel_gap)
+            budget_lst = list(range(Bmin, Bmax + 1))
+            if budget_exploration == "nested":
+                iterate_solutions = lambda budgets: self.iterate_nested_budget_solutions(budgets, problem_kwargs,
+                                                                                         report_deviation)
+            elif budget_exploration == "greedy":
+                iterate_solutions = lambda budgets: self.iterate_greedy_budget_solutions(budgets, problem_kwargs)
+            elif num_workers > 1 and len(budget_lst) > 1:
+                iterate_solutions = lambda budgets: self.iterate_budget_solutions_in_parallel(
+                    budgets, risk_manager, problem_kwargs, num_workers)
+            else:
+                iterate_solutions = lambda budgets: self.iterate_budget_solutions(budgets, problem_kwargs)
+            if self.solution_cache is not None and (integer_programming or self.rounding_seed is not None):
+                # (a selection rounded without a seed is random by intention, hence not cached)
+                cache_key_dict = self.solution_cache_keys(budget_lst, risk_manager, problem_kwargs,
+                                                          budget_exploration, report_deviation)
+                solution_iterator = self.iterate_cached_budget_solutions(budget_lst, cache_key_dict, iterate_solutions)
+            else:
+                solution_iterator = iterate_solutions(budget_lst)
+            total_solver_iterations = None
+            num_cached_solutions = 0
+            pbar = tqdm.tqdm(total=Bmax + 1 - Bmin)
+            try:
+                for B, solution in solution_iterator:
+                    if solution is not None and solution.get("cached"):
+                        num_cached_solutions += 1
+                    elif solution is not None and solution.get("solver_iterations") is not None:
+                        pbar.set_postfix(B=B, iterations=solution["solver_iterations"])
+                        total_solver_iterations = (total_solver_iterations or 0) + solution["solver_iterations"]
+                    pbar.update(1)
+
+                    self.progress = (lambda x: (x[0]+1, x[1]))(self.progress)
+                    if solution is None:
+                        solution_iterator.close()
+                        msg += "Solver failed while solving B={}".format(B)
+                        self.solutions_dictionary = None
+                        self.fig_output_dir = None
+                        self.state = "Initial_main_spreadsheet_loaded"
+                        self.message = msg
+                        return False, msg
+                    self.solutions_dictionary[B] = solution
+            finally:
+                pbar.close()
+            self.solutions_dictionary = dict(sorted(self.solutions_dictionary.items()))
+            if budget_exploration == "nested" and report_deviation:
+                # relative shortfalls (a nested selection can't fall short of an LP selection of a zero objective,
+                # as the objective is non-negative)
+                shortfall_lst = [(solution["lp_objective"] - solution["objective"]) / abs(solution["lp_objective"])
+                                 if solution["lp_objective"] != 0 else 0.0
+                                 for solution in self.solutions_dictionary.values()]
+                msg += "The nested selections are at least as good as the LP selections in {} out of {} budgets " \
+                       "(the largest shortfall in the objective is {:.2%}). ".format(
+                           sum(solution["objective"] >= solution["lp_objective"]
+                               for solution in self.solutions_dictionary.values()), len(shortfall_lst),
+                           max(max(shortfall_lst), 0.0))
+                # the LP bound is an upper bound on the objective of any selection
+                bound_shortfall_lst = [(solution["lp_bound"] - solution["objective"]) / abs(solution["lp_bound"])
+                                       if solution["lp_bound"] != 0 else 0.0
+                                       for solution in self.solutions_dictionary.values()]
+                msg += "The largest shortfall of the nested selections from the LP bound is {:.2%}. ".format(
+                    max(max(bound_shortfall_lst), 0.0))
+            if budget_exploration == "greedy":
+                msg += "The largest optimality gap of the greedy selections is {:.2%}. ".format(
+                    max(solution["optimality_gap"] for solution in self.solutions_dictionary.values()))
+            limited_solution_lst = [solution for solution in self.solutions_dictionary.values()
+                                    if solution.get("time_limit_reached")]
+            if len(limited_solution_lst) > 0:
+                gap_lst = [solution["solver_gap"] for solution in limited_solution_lst
+                           if solution["solver_gap"] is not None]
+                msg += "The time limit was reached in {} out of {} budgets, their best selections so far " \
+                       "were kept{}. ".format(len(limited_solution_lst), len(self.solutions_dictionary),
+                                              " (the largest gap is {:.2%})".format(max(gap_lst))
+                                              if len(gap_lst) > 0 else "")
 
             # Plot of the w(e) and the w(v) as a function of B (one line per w(e)) -
             # plot_budget_exploration(solutions_dictionary=self.solutions_dictionary,
@@ -244,7 +399,12 @@ class Control:
             #                             self.organization_df, self.risk_df, self.current_date, risk_manager),
             #                         plot_dir=self.fig_output_dir, break_to_smaller_plots=False)
             self.state = "Solved"
+            if num_cached_solutions > 0:
+                msg += "The solutions of {} out of {} budgets were taken from the cache. ".format(
+                    num_cached_solutions, len(self.solutions_dictionary))
             msg += "Successfully solved for budgets {}-{}".format(Bmin, Bmax)
+            if total_solver_iterations is not None:
+                msg += " ({} solver iterations)".format(total_solver_iterations)
             self.message = msg
             return True, msg
         else:
@@ -252,7 +412,149 @@ class Control:
             self.message = msg
             return False, msg
 
+    def solution_cache_keys(self, budget_lst: List[int], risk_manager: RiskManager, problem_kwargs: dict,
+                            budget_exploration: str, report_deviation: bool) -> dict:
+        """
+        The cache key of a budget solution is a hash of everything that determines it: the incidence matrix, the
+        names of the people and the groups, the weights, the current date, the parameters of the risk manager, the
+        options of the problem and of the exploration, and the budget.
+        :return: a dictionary of the cache key of every budget
+        """
+        risk_parameters = None if risk_manager is None else (risk_manager.coeff_kind, risk_manager.coeff_vector,
+                                                             risk_manager.discount_kind, risk_manager.discount_vector)
+        problem_hash = content_hash(self.institution.incidence, self.institution.person_lst,
+                                    self.institution.group_lst, self.institution.w, self.current_date.strdate,
+                                    risk_parameters, problem_kwargs, budget_exploration, report_deviation)
+        return {B: content_hash(problem_hash, B) for B in budget_lst}
+
+    def iterate_cached_budget_solutions(self, budget_lst: List[int], cache_key_dict: dict, iterate_solutions):
+        """
+        Yields the cached solutions first (marked by a cached entry), then obtains the solutions of the remaining
+        budgets and caches them (except for the solutions cut short by the time limit, which depend on the machine).
+        :param cache_key_dict: the cache key of every budget, c.f. solution_cache_keys
+        :param iterate_solutions: a function of a list of budgets, which returns a generator of (B, solution) tuples
+        :return: a generator of (B, solution) tuples
+        """
+        missing_budget_lst = []
+        for B in budget_lst:
+            solution = self.solution_cache.get(cache_key_dict[B])
+            if solution is None:
+                missing_budget_lst.append(B)
+            else:
+                yield B, dict(solution, cached=True)
+        if len(missing_budget_lst) == 0:
+            return
+        solution_iterator = iterate_solutions(missing_budget_lst)
+        try:
+            for B, solution in solution_iterator:
+                if solution is not None and not solution.get("time_limit_reached"):
+                    self.solution_cache.put(cache_key_dict[B], solution)
+                yield B, solution
+        finally:
+            solution_iterator.close()
+
+    def iterate_budget_solutions(self, budget_lst: List[int], problem_kwargs: dict):
+        """
+        Solves the budgets one after the other, with a single problem instance built upon self.institution.
+        :return: a generator of (B, solution) tuples, c.f. solve_budget for the solution format
+        """
+        problem = SelectCandidatesForTest(B=budget_lst[0], institution=self.institution, **problem_kwargs)
+        for B in budget_lst:
+            yield B, solve_budget(problem, B, self.current_date, self.solver_path)
+
+    def iterate_nested_budget_solutions(self, budget_lst: List[int], problem_kwargs: dict, report_deviation: bool):
+        """
+        Obtains the selections of all the budgets from a single greedy ordering of the people, c.f.
+        GreedySelection.nested_greedy_ordering, so the selection of each budget is a prefix of the selection of the
+        next budget. Only the weights are computed per budget.
+        :param report_deviation: True --> the problem is also solved for every budget, and each solution reports
+                                 the objective of the nested selection, of the LP selection (lp_objective) and of
+                                 the LP relaxation (lp_bound, an upper bound on the objective of any selection)
+        :return: a generator of (B, solution) tuples, c.f. budget_solution for the solution format (with an additional
+                 objective entry, and lp_objective and lp_bound entries if report_deviation)
+        """
+        problem = SelectCandidatesForTest(B=budget_lst[0], institution=self.institution, **problem_kwargs)
+        ordering = nested_greedy_ordering(problem, max(budget_lst))
+        for B in budget_lst:
+            sampled_person_lst = [self.institution.person_idx_to_name_dict[person_idx]
+                                  for person_idx in ordering[:B].tolist()]
+            extra_entries = dict(objective=problem.objective_value(problem.selection_vector(sampled_person_lst))[1])
+            if report_deviation:
+                problem.set_budget(B)
+                lp_person_lst = problem.solve(path=self.solver_path, verbosity=0)
+                if lp_person_lst is None:
+                    yield B, None
+                    continue
+                extra_entries["lp_objective"] = problem.objective_value(problem.selection_vector(lp_person_lst))[1]
+                # an integer program isn't rounded, its selection is the best one found
+                extra_entries["lp_bound"] = extra_entries["lp_objective"] if problem.relaxation_objective is None \
+                    else problem.relaxation_objective
+                extra_entries["solver_iterations"] = problem.solver_iterations
+                extra_entries["solver_gap"] = problem.solution_gap
+                extra_entries["time_limit_reached"] = problem.status() == 2
+            yield B, budget_solution(self.institution, sampled_person_lst, self.current_date, **extra_entries)
+
+    def iterate_greedy_budget_solutions(self, budget_lst: List[int], problem_kwargs: dict):
+        """
+        Selects the people of every budget by the greedy heuristic of GreedySelectCandidatesForTest (the options
+        of the linear program, such as integer_programming or presolve, do not apply to it). The greedy ordering is
+        computed once for the largest budget, and the selection of every budget is a prefix of it.
+        :return: a generator of (B, solution) tuples, c.f. budget_solution for the solution format (with additional
+                 objective, upper_bound and optimality_gap entries)
+        """
+        problem = GreedySelectCandidatesForTest(B=budget_lst[0], institution=self.institution,
+                                                normalized_coverage=problem_kwargs["normalized_coverage"],
+                                                secondary_objective_coefficient=problem_kwargs[
+                                                    "secondary_objective_coefficient"],
+                                                solver_backend=problem_kwargs["solver_backend"])
+        problem.extend_ordering(max(budget_lst))
+        for B in budget_lst:
+            problem.set_budget(B)
+            sampled_person_lst = problem.solve(path=self.solver_path, verbosity=0)
+            yield B, budget_solution(self.institution, sampled_person_lst, self.current_date,
+                                     objective=problem.objective,
+                                     upper_bound=problem.upper_bound,
+                                     optimality_gap=problem.optimality_gap)
+
+    def iterate_budget_solutions_in_parallel(self, budget_lst: List[int], risk_manager: RiskManager,
+                                             problem_kwargs: dict, num_workers: int):
+        """
+        Fans the budgets out over a pool of processes. Each process builds its own institution and problem once,
+        and then solves the budgets that it receives.
+        :return: a generator of (B, solution) tuples in the order of their completion,
+                 c.f. solve_budget for the solution format
+        """
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(budget_lst)),
+                                 initializer=_init_budget_worker,
+                                 initargs=(self.organization_df, self.risk_df, self.current_date,
+                                           risk_manager, problem_kwargs)) as executor:
+            future_lst = [executor.submit(_solve_budget_in_worker, B, self.current_date, self.solver_path)
+                          for B in budget_lst]
+            try:
+                for future in as_completed(future_lst):
+                    yield future.result()
+            finally:
+                for future in future_lst:
+                    future.cancel()
+
     def produce_checklist(self, budget):
         state, message = produce_checklist(self.solutions_dictionary[budget]['sampled_person_lst'], self.current_date, self.spreadsheet_directory,
                                            "xlsx" if self.main_spreadsheet_path[-4:] == "xlsx" else "odt")
         return state, message
+
+    def export_main_spreadsheet(self) -> Tuple[bool, str]:
+        """
+        Writes the loaded main spreadsheet of the current date, unless it is already written (the main spreadsheets
+        that were set up from the previous days are only written upon solving or exporting).
+        :return: True if the main spreadsheet is written, and a message
+        """
+        if self.organization_df is None or self.risk_df is None:
+            return False, "Please load a spreadsheet first."
+        if os.path.exists(self.main_spreadsheet_path):
+            return True, "The main spreadsheet {} is up to date.".format(self.main_spreadsheet_path)
+        write_succeeded, write_msg = write_main_spreadsheet(self.organization_df, self.risk_df,
+                                                            self.main_spreadsheet_path)
+        if write_succeeded:
+            write_main_spreadsheet_sidecar(self.main_spreadsheet_path, self.organization_df, self.risk_df)
+            return True, "The main spreadsheet was exported to {}.".format(self.main_spreadsheet_path)
+        return False, write_msg
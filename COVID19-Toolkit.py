@@ -1,4 +1,5 @@
 import os, sys
+import multiprocessing
 import json
 import time
 import numpy as np
@@ -6,7 +7,7 @@ import networkx as nx
 from itertools import starmap, filterfalse
 
 from App.Control import Control
-from RiskManager import RiskManager
+from RiskManager import RiskManager, RiskProfileRegistry
 from MyDate import check_strdate, MyDate
 
 from flask import Flask, render_template, request, jsonify, Response
@@ -23,6 +24,7 @@ app.config["TEMPLATES_AUTO_RELOAD"] = True
 app = Flask(__name__, template_folder=os.path.abspath('./template'))
 ctl = Control(root=os.path.abspath(''), spreadsheet_directory="Spreadsheets")
 risk_manager = RiskManager()
+risk_profiles = RiskProfileRegistry(os.path.abspath("./Configurations"))  # the yaml files are loaded once
 
 
 @app.route("/")
@@ -47,18 +49,29 @@ def get_solve():
     global ctl
     args = request.args
     try:
-        risk_manager = RiskManager(os.path.join(os.path.abspath(
-            "./Configurations"), args.get("model_path")))
+        risk_manager = risk_profiles.get(args.get("model_path"))
 
         state, message = ctl.solve(Bmin=int(args.get("Bmin")),
                                    Bmax=int(args.get("Bmax")),
+                                   integer_programming=args.get("ip", "false").lower() == "true",
                                    secondary_objective_coefficient=float(
                                        args.get("ratio")),
-                                   risk_manager=risk_manager
+                                   risk_manager=risk_manager,
+                                   num_workers=int(args.get("workers", ctl.num_workers)),
+                                   budget_exploration=args.get("exploration", ctl.budget_exploration),
+                                   report_deviation=args.get("deviation", "false").lower() == "true",
+                                   time_limit=float(args.get("time_limit")) if "time_limit" in args else None,
+                                   mip_rel_gap=float(args.get("mip_gap")) if "mip_gap" in args else None
                                    )
         response = {budget: (sol['sampled_person_lst'], sol['sampled_groups_lst'])
                     for budget, sol in ctl.solutions_dictionary.items()}
-        return jsonify(message=message, state=state, response=response)
+        gaps = {budget: sol.get('solver_gap', sol.get('optimality_gap'))
+                for budget, sol in ctl.solutions_dictionary.items()}
+        upper_bounds = {budget: sol.get('upper_bound') for budget, sol in ctl.solutions_dictionary.items()}
+        time_limit_reached = [budget for budget, sol in ctl.solutions_dictionary.items()
+                              if sol.get('time_limit_reached')]
+        return jsonify(message=message, state=state, response=response, gaps=gaps, upper_bounds=upper_bounds,
+                       time_limit_reached=time_limit_reached)
     except Exception as err:
         return jsonify(error=str(err), state=False)
 
@@ -96,8 +109,7 @@ def get_institution():
             wE[Bid] = solutions_dictionary[B]['wE']
         group = list(starmap(lambda g, w: {"group": g, "weight": w}, zip(
             group_lst, [wE[:, pid].tolist() for pid in range(len(group_lst))])))
-        graph = dict(filter(
-            lambda x: "_" in x[0], nx.to_dict_of_lists(ctl.institution.G).items()))
+        graph = ctl.institution.to_dict_of_lists()
         return jsonify(state=True, response={"group": group, "graph":  graph})
     except Exception as err:
         return jsonify(error=str(err), state=False)
@@ -110,8 +122,7 @@ def get_risk_model():
     try:
         path = args.get("path")
         if path is not None:
-            risk_manager = RiskManager(os.path.join(os.path.abspath(
-                "./Configurations"), path))
+            risk_manager = risk_profiles.get(path)
         else:
             risk_manager.set_coefficients(risk_factor_coeff_kind=args.get(
                 "coefficients[risk_factor_coeff_kind]"), arg=args.get("coefficients[arg]"))
@@ -139,13 +150,13 @@ def save_risk_model():
     config_path = args.get("config_path")
     risk_manager.save(os.path.join(
         os.path.abspath("./Configurations"), config_path))
+    risk_profiles.invalidate(config_path)
     return jsonify(state=True)
 
 
 @app.route("/model_list")
 def get_model_list():
-    config_path = os.path.abspath("./Configurations")
-    return jsonify(list=[f for f in os.listdir(config_path) if os.path.isfile(os.path.join(config_path, f))])
+    return jsonify(list=risk_profiles.list_profiles())
 
 
 @app.route("/checklist/")
@@ -159,6 +170,17 @@ def get_checklist():
         return jsonify(error=str(err), state=False)
 
 
+@app.route("/export/")
+def get_export():
+    global ctl
+    try:
+        state, message = ctl.export_main_spreadsheet()
+        return jsonify(message=message, state=state)
+    except Exception as err:
+        return jsonify(error=str(err), state=False)
+
+
 # start process
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # required by the parallel budget sweep in a frozen (pyinstaller) executable
     app.run(host='127.0.0.1', port=5000, threaded=True, debug=False)
@@ -0,0 +1,215 @@
+import numpy as np
+import scipy.sparse as sp
+from typing import Union
+from Institution import Institution
+from LinearProgramming import SelectCandidatesForTest
+from SolverBackends import SolverBackend
+
+
+def nested_greedy_ordering(problem: SelectCandidatesForTest, num_people: int, smoothing: float = 0.01) -> np.ndarray:
+    """
+    Orders the people by a greedy maximization of a concave surrogate of the objective of the problem:
+        F(S) = sum_e log(smoothing * C(e) + c_S(e)) + regularizer * sum_e c_S(e)
+    where the first sum goes over the active groups, c_S(e) is the coverage of group e by the people in S, and
+    C(e) is the coverage of group e when everyone is tested. The logarithm favours the least covered groups (as
+    the max-min objective does). The gain of every person is kept up to date: selecting a person changes only the
+    gains of the members of the groups of the selected person, so only these are updated.
+    The first B people of the ordering are the selection for the budget B, thus the selections of all the budgets
+    are obtained in a single pass and are nested (the selection of B is a prefix of the selection of B+1).
+    :param problem: SelectCandidatesForTest, which defines the coverages, the active groups and the regularizer
+    :param num_people: number of people to order (i.e. the maximal budget)
+    :param smoothing: positive float, the relative coverage of a group below which it is considered uncovered
+    :return: 1D array of person indices, of length min(num_people, number of people in the institution)
+    """
+    num_people = min(num_people, len(problem.institution.person_lst))
+    active_coverage_csr = problem.coverage_matrix[problem.active_group_mask]
+    active_coverage_csc = active_coverage_csr.tocsc()
+    full_coverage = np.asarray(active_coverage_csr.sum(axis=1)).ravel()
+    offset = smoothing * full_coverage + np.finfo(np.float64).tiny
+    group_coverage = np.zeros(active_coverage_csr.shape[0])
+
+    # gains of all the people when none is selected, -inf marks the selected people
+    gain = log1p_column_sums(active_coverage_csc, offset) + \
+        problem.regularizer * np.asarray(problem.coverage_matrix.sum(axis=0)).ravel()
+    ordering = np.zeros(num_people, dtype=np.int64)
+    for position in range(num_people):
+        person_idx = int(np.argmax(gain))
+        ordering[position] = person_idx
+        gain[person_idx] = -np.inf
+        start, end = active_coverage_csc.indptr[person_idx], active_coverage_csc.indptr[person_idx + 1]
+        for group_idx, contribution in zip(active_coverage_csc.indices[start:end].tolist(),
+                                           active_coverage_csc.data[start:end].tolist()):
+            # the gain of each member v of the group shrinks from log(1 + a_v/(offset + c)) to
+            # log(1 + a_v/(offset + c + contribution))
+            row_start, row_end = active_coverage_csr.indptr[group_idx], active_coverage_csr.indptr[group_idx + 1]
+            members = active_coverage_csr.indices[row_start:row_end]
+            member_contribution = active_coverage_csr.data[row_start:row_end]
+            previous_base = offset[group_idx] + group_coverage[group_idx]
+            group_coverage[group_idx] += contribution
+            gain[members] -= np.log1p(member_contribution / previous_base) - \
+                np.log1p(member_contribution / (previous_base + contribution))
+    return ordering
+
+
+def log1p_column_sums(matrix: sp.spmatrix, offset: np.ndarray) -> np.ndarray:
+    """
+    :param matrix: sparse (groups x people) CSC matrix
+    :param offset: 1D array of a positive value per group (row)
+    :return: 1D array, whose entry v is sum_e log(1 + matrix[e, v] / offset[e])
+    """
+    terms = matrix.copy()
+    terms.data = np.log1p(terms.data / offset[terms.indices])
+    return np.asarray(terms.sum(axis=0)).ravel()
+
+
+def top_row_sums(matrix: sp.spmatrix, k: int) -> np.ndarray:
+    """
+    :param matrix: sparse matrix with non-negative entries
+    :param k: number of entries to sum per row
+    :return: 1D array, whose entry r is the sum of the k largest entries of row r
+    """
+    matrix = sp.csr_matrix(matrix)
+    row = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, row))  # by row, then by a descending value
+    rank_in_row = np.arange(len(order)) - matrix.indptr[row[order]]
+    kept = order[rank_in_row < k]
+    return np.bincount(row[kept], weights=matrix.data[kept], minlength=matrix.shape[0])
+
+
+class GreedySelectCandidatesForTest(SelectCandidatesForTest):
+    """
+    A fast alternative to the linear program of SelectCandidatesForTest, for very large institutions. The people are
+    selected by a log-surrogate marginal-gain ordering (c.f. nested_greedy_ordering): the greedy maximizes a concave
+    surrogate of the objective - the minimal coverage of the active groups plus the regularized sum of coverages -
+    rather than the objective itself, under the same coverage definitions. The ordering is nested, so it is computed
+    once for the largest budget, and the selection of every budget is a prefix of it. Since the heuristic carries no optimality guarantee, each solution reports an upper bound
+    on the optimal objective and the resulting optimality gap.
+    """
+    def __init__(self, B: int, institution: Institution,
+                 normalized_coverage=True,
+                 secondary_objective_coefficient=0.01,
+                 lp_relaxation_bound=False,
+                 solver_backend: Union[str, SolverBackend] = "highs",
+                 smoothing=0.01,
+                 bound_iterations=50):
+        """
+
+        :param B: maximum number of allowed tests (budget)
+        :param institution: an object encompassing the structure of the organization
+        :param normalized_coverage: c.f. SelectCandidatesForTest
+        :param secondary_objective_coefficient: c.f. SelectCandidatesForTest
+        :param lp_relaxation_bound: True --> the LP relaxation is also solved (by the solver_backend), for the
+                                    tightest upper bound on the optimal objective.
+                                    False --> only the Lagrangian upper bound is computed (c.f. self.upper_bound_of_budget)
+        :param solver_backend: c.f. SelectCandidatesForTest (only used if lp_relaxation_bound)
+        :param smoothing: c.f. nested_greedy_ordering
+        :param bound_iterations: number of iterations for tightening the upper bound (c.f. self.upper_bound_of_budget)
+        """
+        SelectCandidatesForTest.__init__(self, B, institution,
+                                         integer_programming=False,
+                                         normalized_coverage=normalized_coverage,
+                                         secondary_objective_coefficient=secondary_objective_coefficient,
+                                         solver_backend=solver_backend,
+                                         formulation="matrix")
+        self.lp_relaxation_bound = lp_relaxation_bound
+        self.smoothing = smoothing
+        self.bound_iterations = bound_iterations
+        self.ordering = None          # the greedy ordering of the people, c.f. self.extend_ordering
+        self.objective = None         # objective of the last solution
+        self.upper_bound = None       # upper bound on the optimal objective (for the budget of the last solution)
+        self.optimality_gap = None    # (upper_bound - objective) / upper_bound
+
+    def __str__(self):
+        return "People Selection Greedy Heuristic (log-surrogate marginal-gain ordering) with the following parameters:\n B={}".format(self.B)
+
+    def extend_ordering(self, num_people: int):
+        """
+        Computes the greedy ordering of num_people people (c.f. nested_greedy_ordering), unless the current ordering
+        already covers them. Since the ordering is nested, the selections of all the budgets up to num_people are
+        its prefixes.
+        :param num_people: number of people to order (i.e. the maximal budget)
+        """
+        num_people = min(num_people, len(self.institution.person_lst))
+        if self.ordering is None or len(self.ordering) < num_people:
+            self.ordering = nested_greedy_ordering(self, num_people, smoothing=self.smoothing)
+
+    def upper_bound_of_budget(self) -> float:
+        """
+        For any distribution lambda over the active groups, the minimal coverage is at most the lambda-weighted
+        average coverage, hence the optimal objective (even of the LP relaxation) is bounded by
+            L(lambda) = sum of the B largest entries of (lambda^T A + regularizer * column sums of the coverage matrix)
+        where A is the coverage matrix of the active groups. The bound is tightened (towards the LP optimum) by
+        self.bound_iterations multiplicative-weights steps, which shift lambda towards the groups that the maximizing
+        selection covers the least. The single-group distributions give the additional bound
+            min_e (sum of the B largest coefficients of the coverage of e) + regularizer * (sum of the B largest
+            column sums of the coverage matrix)
+        :return: float, the tightest of the bounds above
+        """
+        num_people = len(self.institution.person_lst)
+        secondary_score = self.regularizer * np.asarray(self.coverage_matrix.sum(axis=0)).ravel()
+        if self.B >= num_people:
+            top_secondary = secondary_score.sum()
+        else:
+            top_secondary = secondary_score[np.argpartition(-secondary_score, self.B - 1)[:self.B]].sum()
+        if not self.active_group_mask.any():
+            return top_secondary
+        active_coverage_matrix = self.coverage_matrix[self.active_group_mask]
+        upper_bound = top_row_sums(active_coverage_matrix, self.B).min() + top_secondary
+
+        active_coverage_matrix_t = active_coverage_matrix.T.tocsr()
+        num_groups = active_coverage_matrix.shape[0]
+        group_distribution = np.full(num_groups, 1.0 / num_groups)
+        for iteration in range(self.bound_iterations):
+            score = active_coverage_matrix_t.dot(group_distribution) + secondary_score
+            selection = np.zeros(num_people)
+            if self.B >= num_people:
+                selection[:] = 1.0
+            else:
+                selection[np.argpartition(-score, self.B - 1)[:self.B]] = 1.0
+            upper_bound = min(upper_bound, score.dot(selection))
+            group_coverage = active_coverage_matrix.dot(selection)
+            step = 2.0 * np.sqrt(np.log(num_groups) / (iteration + 1)) / max(group_coverage.max(),
+                                                                          np.finfo(np.float64).tiny)
+            group_distribution *= np.exp(-step * (group_coverage - group_coverage.min()))
+            group_distribution /= group_distribution.sum()
+        return upper_bound
+
+    def solve(self, path="", verbosity=0):
+        """
+        Selects the first B people of the greedy ordering (c.f. self.extend_ordering), and computes the upper bound
+        and the optimality gap of the selection (self.objective, self.upper_bound, self.optimality_gap). The upper
+        bound depends on the budget, so it is computed on every solve.
+        :param path: a path to the solver executable (only used if lp_relaxation_bound with the "glpk" solver backend)
+        :param verbosity: 0 - no messages, 1 - only python messages, 2 - python and solver messages
+        :return: list of person chosen for sampling
+        """
+        self.extend_ordering(self.B)
+        sampled_person_lst = [self.institution.person_idx_to_name_dict[person_idx]
+                              for person_idx in self.ordering[:self.B].tolist()]
+        z, self.objective = self.objective_value(self.selection_vector(sampled_person_lst))
+
+        self.upper_bound = self.upper_bound_of_budget()
+        self.solver_iterations = None
+        if self.lp_relaxation_bound:
+            try:
+                result = self.get_backend(path).solve(self, verbosity=verbosity)
+            except:
+                result = None
+            if result is not None and result.status == 1:
+                matrix_form = self.get_matrix_form()
+                self.upper_bound = min(self.upper_bound, -matrix_form.c.dot(np.append(result.x, result.z)))
+                self.solver_iterations = result.iterations
+            elif verbosity > 0:
+                print("Failed solving the LP relaxation, only the Lagrangian upper bound is reported")
+        self.optimality_gap = (self.upper_bound - self.objective) / abs(self.upper_bound) if self.upper_bound != 0 else 0.0
+        self.solver_status = 1
+
+        num_selected_people = len(sampled_person_lst)
+        if verbosity > 0:
+            print("Found a solution (z={}): People chosen for sampling".format(z))
+            print(sampled_person_lst)
+            print("-" * 72)
+            print("The solution selected {} {} (B was set to {})".format(num_selected_people, "person" if num_selected_people == 1 else "people", self.B))
+            print("Objective: {}, upper bound: {}, optimality gap: {:.2%}".format(self.objective, self.upper_bound,
+                                                                                 self.optimality_gap))
+        return sampled_person_lst
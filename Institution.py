@@ -2,15 +2,16 @@ __author__ = "Kostya Berestizshevsky"
 __version__ = "0.1.0"
 __license__ = "MIT"
 import os
-import itertools
+import copy
 import numpy as np
 import networkx as nx
 import pandas
+import scipy.sparse as sp
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from Util.numeric import modified_sigmoid_vector
-from MyDate import MyDate
+from MyDate import MyDate, NO_DATE, strdates_to_days, days_to_mydate
 from RiskManager import RiskManager
 from typing import Tuple, List, Union, Iterable
 
@@ -34,19 +35,81 @@ class Institution:
         self.person_name_to_idx_dict = {pname: pid for pid, pname in enumerate(self.person_lst)}
         self.group_name_to_idx_dict  = {gname: gid for gid, gname in enumerate(self.group_lst)}
 
-        # Graph
-        self.G = nx.Graph()
-        self.G.add_nodes_from(self.person_lst + self.group_lst)
-        for personid_name_tuple, group in itertools.product(enumerate(self.person_lst), self.group_lst):
-            personid, person = personid_name_tuple
-            if organization_df[group][personid]:
-                self.G.add_edge(person, group)
+        # Bipartite structure - a (people x groups) binary incidence matrix, built directly from the group columns.
+        # The CSR copy slices the groups of a person, the CSC copy slices the people of a group.
+        # The networkx graph (self.G) is only built on demand, c.f. for drawing.
+        membership = organization_df[self.group_lst].to_numpy() != 0
+        self.incidence = sp.csr_matrix(membership, dtype=np.int8)
+        self.incidence_csc = self.incidence.tocsc()
+        self._graph = None
 
-        # Set the weight attribute for each node in the graph - both in self.nodes_attributes and in self.G
+        # Struct-of-arrays node data (one entry per person / per group, ordered as self.person_lst / self.group_lst)
+        # The per-node dictionaries (self.nodes_attributes) are only a compatibility view built from these arrays.
         self.risk_manager = risk_manager
-        self.nodes_attributes = {}
+        self.weighted_risk_matrix = None  # people x risk-factors, the risk factor scores scaled by their coefficients
+        self.r = None                     # static (weighted) risk of each person
+        self.test_day = None              # day of the most recent test of each person (c.f. MyDate.days), or NO_DATE
+        self.discount_factor = None       # discount factor (lambda) of each person
+        self.w = None                     # weight (discounted risk) of each person
+        self.wE = None                    # weight of each group - sum of the weights of its people
+        self.weights_day = None           # the day (c.f. MyDate.days) for which self.w and self.wE were computed
+        self._updated_person_idx_set = set()  # people whose test date changed since the last weight update
+        self._nodes_attributes = None
         self.init_nodes_attributes(risk_df)
 
+    def copy(self) -> "Institution":
+        """
+        Returns a copy of this institution, whose test dates and weights can be updated independently.
+        The organizational structure and the static risks are shared with the original (they are never modified).
+        """
+        institution_copy = copy.copy(self)
+        institution_copy.test_day = self.test_day.copy()
+        institution_copy.discount_factor = self.discount_factor.copy()
+        institution_copy.w = self.w.copy()
+        institution_copy.wE = self.wE.copy()
+        institution_copy._updated_person_idx_set = set(self._updated_person_idx_set)
+        institution_copy._nodes_attributes = None
+        institution_copy._graph = None
+        return institution_copy
+
+    @property
+    def G(self) -> nx.Graph:
+        """
+        A networkx view of the institution - a bipartite graph of people and groups, carrying the node attributes.
+        The view is built lazily (on the first access after the attributes were changed), since only the drawing
+        routines require it. Prefer the incidence-matrix based methods of this class for any computation.
+        """
+        if self._graph is None:
+            graph = nx.Graph()
+            graph.add_nodes_from(self.person_lst + self.group_lst)
+            person_idx_arr, group_idx_arr = self.incidence.nonzero()
+            graph.add_edges_from((self.person_lst[pid], self.group_lst[gid])
+                                 for pid, gid in zip(person_idx_arr, group_idx_arr))
+            nx.set_node_attributes(graph, self.nodes_attributes)
+            self._graph = graph
+        return self._graph
+
+    @property
+    def nodes_attributes(self) -> dict:
+        """
+        A compatibility view of the node data as a dictionary of dictionaries, keyed by the node (person or group)
+        name. Each person has the 'weighted_risk_vector', 'discount_factor', 'r', 'ts' and 'w' values, and each
+        group has the 'w' value. The view is built lazily from the arrays of this class, and is rebuilt after
+        any weight update. Modifying it has no effect on the institution.
+        """
+        if self._nodes_attributes is None:
+            nodes_attributes = {}
+            for pid, person in enumerate(self.person_lst):
+                nodes_attributes[person] = {'weighted_risk_vector': self.weighted_risk_matrix[pid],
+                                            'discount_factor': float(self.discount_factor[pid]),
+                                            'r': self.r[pid],
+                                            'ts': days_to_mydate(self.test_day[pid]),
+                                            'w': float(self.w[pid])}
+            for gid, group in enumerate(self.group_lst):
+                nodes_attributes[group] = {'w': float(self.wE[gid])}
+            self._nodes_attributes = nodes_attributes
+        return self._nodes_attributes
+
     def get_discount_factor(self, t: MyDate, ts: MyDate):
         """
         Given the current time "t" and the most recent time ts at which a sampling was made
@@ -64,14 +127,14 @@ class Institution:
 
     def init_nodes_attributes(self, risk_df: pandas.DataFrame):
         """
-        Sets each person a dictionary with the following 3 values:
-            'r': initial risk - is set to the provided risk (as provided in the risk_df)
-            'ts': time of the most recent test date of this person
-            'w': current weight - the discounted risk
-        Sets each group a dictionary with the following 3 values:
-            'w': current weight - equal to the sum of all the weights of the people associated with this group
+        Sets for each person (as arrays, ordered as self.person_lst) the following values:
+            self.r: initial risk - is set to the provided risk (as provided in the risk_df)
+            self.test_day: the day of the most recent test of this person (c.f. MyDate.days)
+            self.w: current weight - the discounted risk
+        Sets for each group (as an array, ordered as self.group_lst) the following value:
+            self.wE: current weight - equal to the sum of all the weights of the people associated with this group
 
-        This function updates both the self.nodes_attributes and the self.G
+        This function updates the node arrays (the self.nodes_attributes and self.G views are rebuilt on their next access)
 
         :param risk_df: a pandas dataframe carrying 3 columns of people id data,
                         followed by 1 column of 'Date of last COVID19 test' or 'תאריך בדיקה אחרון'
@@ -83,40 +146,34 @@ class Institution:
         num_risk_factors = len(risk_df.columns) - self.num_risk_df_columns_that_arent_risk_factors
         risk_factor_coefficients = self.risk_manager.get_coefficients(num_risk_factors)
 
-        for personid, person in enumerate(self.person_lst):
-            personal_risk_vector = np.array(risk_df.iloc[personid, self.num_risk_df_columns_that_arent_risk_factors:],
-                                            dtype=np.float32)
-            personal_weighted_risk_vector = np.multiply(personal_risk_vector, risk_factor_coefficients)
-            personal_static_risk = np.sum(personal_weighted_risk_vector)
-            personal_test_date_str = risk_df[covid_test_col_str][personid]
-            personal_test_date = MyDate(strdate=personal_test_date_str) if personal_test_date_str != "" else None
-            self.nodes_attributes[person] = {'weighted_risk_vector': personal_weighted_risk_vector,
-                                             'discount_factor' : 1.0,
-                                             'r' : personal_static_risk,
-                                             'ts': personal_test_date,
-                                             'w' : 0.0}
-        for group in self.group_lst:
-            self.nodes_attributes[group] = {'w': 0.0}
+        risk_matrix = risk_df.iloc[:, self.num_risk_df_columns_that_arent_risk_factors:].to_numpy(dtype=np.float32)
+        self.weighted_risk_matrix = np.multiply(risk_matrix, risk_factor_coefficients)
+        self.r = self.weighted_risk_matrix.sum(axis=1)
+        self.test_day = strdates_to_days(risk_df[covid_test_col_str])
+        self.discount_factor = np.ones(len(self.person_lst), dtype=np.float64)
+        self.w = np.zeros(len(self.person_lst), dtype=np.float64)
+        self.wE = np.zeros(len(self.group_lst), dtype=np.float64)
 
-        self.update_weights(current_date=self.current_date)  # this recalculates the group weights and updates the graph
+        self.update_weights(current_date=self.current_date)  # this recalculates the group weights
 
     def update_test_date(self, sampled_person_lst: list, test_date: MyDate):
         """
         Update the state of the sampled_person_lst such that their sampling time is
         update to the provided "sampling_time_step" value.
-
-        This function updates both the self.nodes_attributes and the self.G
+        The weights are not recalculated until the next call to update_weights, which
+        will (by default) only recalculate the people updated here and their groups.
 
         :param sampled_person_lst:list of strings
         :param test_date: a date at which the person was tested
         :return:
         """
 
-        for person in sampled_person_lst:
-            self.nodes_attributes[person]['ts'] = test_date
-        nx.set_node_attributes(self.G, self.nodes_attributes)
+        person_idx_lst = [self.person_name_to_idx_dict[person] for person in sampled_person_lst]
+        self.test_day[person_idx_lst] = test_date.days
+        self._updated_person_idx_set.update(person_idx_lst)
+        self._refresh_views(person_idx_lst, [])
 
-    def update_weights(self, current_date: MyDate):
+    def update_weights(self, current_date: MyDate, incremental: bool = True):
         """
         (1) Update the weights (by discounting the risks) of all the people in the organization
         (2) Update the discount_factors (lambda) of all the people in the organization, based on
@@ -128,27 +185,79 @@ class Institution:
         if the person was sampled during the last week --> his weight is 0.0
         if the person was sampled
 
-        This function updates both the self.nodes_attributes and the self.G
+        When the weights were already computed for the same "current_date", only the people whose test date
+        was updated since (via update_test_date) are recalculated, and their weight deltas are added to their
+        groups. The cost is then proportional to the number of group memberships of these people.
+
+        This function updates the node arrays, as well as the self.nodes_attributes and self.G views.
 
         :param current_date: a date for which the weights of the people (and of the groups)
                              should be recalculated. The recalculation will be a result of
                              a new time intervals between the date each person was tested,
                              and the current_date (due to a discount factor).
+        :param incremental: False --> always recalculate the whole organization.
         """
+        if incremental and self.weights_day == current_date.days:
+            person_idx_arr = np.array(sorted(self._updated_person_idx_set), dtype=np.int64)
+            if len(person_idx_arr) > 0:
+                # (1+2) recalculate the discount factors and weights of the updated people only
+                self.discount_factor[person_idx_arr] = self.get_discount_factors(current_date, person_idx_arr)
+                new_w = self.r[person_idx_arr].astype(np.float64) * self.discount_factor[person_idx_arr]
+                delta_w = new_w - self.w[person_idx_arr]
+                self.w[person_idx_arr] = new_w
+
+                # (3) propagate the weight deltas into the groups of the updated people
+                updated_incidence = self.incidence[person_idx_arr]
+                self.wE += updated_incidence.T.dot(delta_w)
+                group_idx_arr = np.unique(updated_incidence.indices)
+                self._refresh_views(person_idx_arr.tolist(), group_idx_arr.tolist())
+        else:
+            # (1+2) recalculate the person discount factors and weights
+            self.discount_factor = self.get_discount_factors(current_date, np.arange(len(self.person_lst)))
+            self.w = self.r.astype(np.float64) * self.discount_factor
 
-        # (1+2) recalculate the person discount factors and weights
-        for person in self.person_lst:
-            #  this person was sampled before, apply the strategy!
-            discount_factor = self.get_discount_factor(current_date, self.nodes_attributes[person]['ts'])
-            self.nodes_attributes[person]['discount_factor'] = discount_factor
-            self.nodes_attributes[person]['w'] = self.nodes_attributes[person]['r'] * discount_factor
+            # (3) recalculate the group weights - a single sparse matrix-vector product
+            self.wE = self.incidence_csc.T.dot(self.w)
 
-        # (3) recalculate the group weights
-        for group in self.group_lst:
-            self.nodes_attributes[group]['w'] = sum(self.nodes_attributes[person]['w'] for person in self.G.neighbors(group))
+            # (finally) invalidate the dictionary and graph views, they will be rebuilt upon their next access.
+            self._nodes_attributes = None
+            self._graph = None
+
+        self.weights_day = current_date.days
+        self._updated_person_idx_set.clear()
 
-        # (finally) plug all the node_attributes back into the graph structure.
-        nx.set_node_attributes(self.G, self.nodes_attributes)
+    def get_discount_factors(self, current_date: MyDate, person_idx_arr: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of get_discount_factor for a subset of people.
+        :param current_date: current time step
+        :param person_idx_arr: 1D array of the indices of the people
+        :return: 1D array of discount factors, ordered as person_idx_arr. People that
+                 were never tested aren't discounted (factor 1.0).
+        """
+        discount_factor = np.ones(len(person_idx_arr), dtype=np.float64)
+        test_day = self.test_day[person_idx_arr]
+        tested_mask = test_day != NO_DATE
+        if tested_mask.any():
+            time_elapsed = current_date.days - test_day[tested_mask]
+            discount_factor[tested_mask] = self.risk_manager.get_discounts(time_elapsed)
+        return discount_factor
+
+    def _refresh_views(self, person_idx_lst: List[int], group_idx_lst: List[int]):
+        """
+        Patch the already built self.nodes_attributes and self.G views with the current
+        array values of the given people and groups (views that weren't built yet are left alone).
+        """
+        if self._nodes_attributes is None:
+            return
+        for pid in person_idx_lst:
+            self._nodes_attributes[self.person_lst[pid]].update({'discount_factor': float(self.discount_factor[pid]),
+                                                                 'ts': days_to_mydate(self.test_day[pid]),
+                                                                 'w': float(self.w[pid])})
+        for gid in group_idx_lst:
+            self._nodes_attributes[self.group_lst[gid]]['w'] = float(self.wE[gid])
+        if self._graph is not None:
+            node_lst = [self.person_lst[pid] for pid in person_idx_lst] + [self.group_lst[gid] for gid in group_idx_lst]
+            nx.set_node_attributes(self._graph, {node: self._nodes_attributes[node] for node in node_lst})
 
     def get_groups_of_people(self, person_lst, format="dict"):
         """
@@ -159,13 +268,9 @@ class Institution:
                                  The returned dictionary has group_names as keys and people count as value
         :return: dictionary of group:num_sampled_person
         """
-        sampled_groups_dict = {}
-        for group_lst_of_person in [list(self.G.neighbors(person)) for person in person_lst]:
-            for group in group_lst_of_person:
-                if group in sampled_groups_dict:
-                    sampled_groups_dict[group] += 1
-                else:
-                    sampled_groups_dict[group] = 1
+        person_idx_lst = [self.person_name_to_idx_dict[person] for person in person_lst]
+        group_counts = np.asarray(self.incidence[person_idx_lst].sum(axis=0)).ravel()
+        sampled_groups_dict = {self.group_lst[gid]: int(group_counts[gid]) for gid in np.flatnonzero(group_counts)}
 
         if format == "dict":
             return sampled_groups_dict
@@ -175,9 +280,33 @@ class Institution:
             raise TypeError("For the format keyword 'format' the only acceptable "
                             "values are 'dict' or 'list'. Given:{}".format(format))
 
+    def get_people_idx_of_one_group(self, group_idx: int) -> np.ndarray:
+        """
+        :param group_idx: index of a group (a column of the incidence matrix)
+        :return: 1D array of the indices of the people associated with this group
+        """
+        return self.incidence_csc.indices[self.incidence_csc.indptr[group_idx]:self.incidence_csc.indptr[group_idx + 1]]
+
+    def get_groups_idx_of_one_person(self, person_idx: int) -> np.ndarray:
+        """
+        :param person_idx: index of a person (a row of the incidence matrix)
+        :return: 1D array of the indices of the groups that this person is associated with
+        """
+        return self.incidence.indices[self.incidence.indptr[person_idx]:self.incidence.indptr[person_idx + 1]]
+
     def get_people_of_one_group(self, group):
-        assert group in self.group_lst
-        return list(self.G.neighbors(group))
+        assert group in self.group_name_to_idx_dict
+        return [self.person_lst[pid] for pid in self.get_people_idx_of_one_group(self.group_name_to_idx_dict[group])]
+
+    def get_groups_of_one_person(self, person):
+        assert person in self.person_name_to_idx_dict
+        return [self.group_lst[gid] for gid in self.get_groups_idx_of_one_person(self.person_name_to_idx_dict[person])]
+
+    def to_dict_of_lists(self) -> dict:
+        """
+        :return: a dictionary mapping each person to the list of groups that this person is associated with.
+        """
+        return {person: self.get_groups_of_one_person(person) for person in self.person_lst}
 
     def draw(self, node_size=200, marked_nodes=[], output_dir=None, output_filename=None, output_type="png",
              keep_fig_open=False, figsize=(16, 24), margins=0.2, font_size=12, crop_center=False):
@@ -208,8 +337,8 @@ class Institution:
         selected_edge_to_mark = [] # list of edges of a format (person,group)
         for node_name in marked_nodes:
             selected_positions_to_mark[node_name] = node_positions[node_name]
-            if node_name in self.person_lst:
-                for group_name in self.G.neighbors(node_name):
+            if node_name in self.person_name_to_idx_dict:
+                for group_name in self.get_groups_of_one_person(node_name):
                     selected_edge_to_mark.append((node_name,group_name))
 
         nx.draw_networkx_nodes(self.G, node_positions,
@@ -287,16 +416,15 @@ class Institution:
         :param sampled_person_lst: list of person
         """
         print("Coverage per group:")
-        for group in self.group_lst:
-            people_of_group_lst = self.get_people_of_one_group(group)
-            group_coverage = 0.0
-            group_num_sampled_person = 0
-            for person in people_of_group_lst:
-                if person in sampled_person_lst:
-                    group_coverage += self.nodes_attributes[person]['w']
-                    group_num_sampled_person += 1
+        sampled = np.zeros(len(self.person_lst), dtype=bool)
+        sampled[[self.person_name_to_idx_dict[person] for person in sampled_person_lst]] = True
+        group_coverage_arr = self.incidence_csc.T.dot(self.w * sampled)
+        group_num_sampled_arr = self.incidence_csc.T.dot(sampled.astype(np.int64))
+        group_num_people_arr = np.diff(self.incidence_csc.indptr)
+        for gid, group in enumerate(self.group_lst):
+            group_coverage = group_coverage_arr[gid]
             if normalize_coverage:
-                group_cov_norm = self.nodes_attributes[group]['w'] if self.nodes_attributes[group]['w'] != 0 else 1
+                group_cov_norm = self.wE[gid] if self.wE[gid] != 0 else 1
                 group_coverage = group_coverage / group_cov_norm
-            print(' coverage({}) = {:.3f} ({}/{} person)'.format(group, group_coverage, group_num_sampled_person,
-                                                                 len(people_of_group_lst)))
\ No newline at end of file
+            print(' coverage({}) = {:.3f} ({}/{} person)'.format(group, group_coverage, group_num_sampled_arr[gid],
+                                                                 group_num_people_arr[gid]))
@@ -81,8 +81,7 @@ def get_institution():
             wE[Bid] = solutions_dictionary[B]['wE']
         group = list(starmap(lambda g, w: {"group": g, "weight": w}, zip(
             group_lst, [wE[:, pid].tolist() for pid in range(len(group_lst))])))
-        graph = dict(filter(
-            lambda x: "_" in x[0], nx.to_dict_of_lists(ctl.institution.G).items()))
+        graph = ctl.institution.to_dict_of_lists()
         return jsonify(state=True, response={"group": group, "graph":  graph})
     except Exception as err:
         return jsonify(error=str(err), state=False)
@@ -1,6 +1,13 @@
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
 import pulp as pl
 import numpy as np
+import scipy.sparse as sp
 from Institution import Institution
+from SolverBackends import SolverBackend, SolverResult, MatrixForm, make_solver_backend, \
+    pulp_problem_to_matrix_form, matrix_form_to_pulp_problem, relative_gap
+from typing import Tuple, Union
 
 
 class SelectCandidatesForTest:
@@ -12,7 +19,16 @@ class SelectCandidatesForTest:
     def __init__(self, B: int, institution: Institution,
                  integer_programming=False,
                  normalized_coverage=True,
-                 secondary_objective_coefficient=0.01):
+                 secondary_objective_coefficient=0.01,
+                 solver_backend: Union[str, SolverBackend] = "highs",
+                 formulation="pulp",
+                 warm_start=True,
+                 presolve=False,
+                 rounding_trials=1,
+                 rounding_seed=None,
+                 lazy_constraints=0,
+                 time_limit=None,
+                 mip_rel_gap=None):
         """
 
         :param B: maximum number of allowed tests (budget)
@@ -23,90 +39,412 @@ class SelectCandidatesForTest:
                                     False --> coverage(group) = sum of weights of tested people in the group
                                     True  --> coverage(group) = sum of weights of tested people in the group / weight of the group
         :param secondary_objective_coefficient: float - a coefficient to multiply the secondary objective of the optimization.
+        :param solver_backend: a SolverBackend instance, or a name of one - "highs" (in-process) or "glpk" (glpsol
+                               executable, whose path is given to self.solve)
+        :param formulation: "pulp" --> the problem is built from pulp expressions (the matrix form is derived from it
+                                       if the solver backend requires it).
+                            "matrix" --> the matrix form is built directly from the incidence matrix and the weights
+                                         of the institution (the pulp problem is derived from it only if the solver
+                                         backend requires it). Much faster and lighter for large institutions.
+        :param warm_start: True --> consecutive solves of this problem (e.g. after self.set_budget) start from the
+                           previous solution, if the solver backend supports it.
+        :param presolve: True --> interchangeable people (the same groups and the same weight) are collapsed into a
+                         single variable counting how many of them are selected, and people of zero weight are left
+                         out of the problem (c.f. self.build_person_classes). The problem is then always built in the
+                         matrix form (the pulp problem is derived from it if the solver backend requires it).
+        :param rounding_trials: number of randomized roundings of the fractional solution, of which the best one is
+                                kept (c.f. self.round_solution). Irrelevant for integer programming.
+        :param rounding_seed: an integer seed of the randomized rounding, for reproducible selections. None --> fresh
+                              randomness on every solve.
+        :param lazy_constraints: 0 --> the constraints of all the active groups are part of the problem up front.
+                                 k > 0 --> constraint generation (c.f. self.solve_with_lazy_constraints): the problem
+                                 starts with the constraints of the k active groups of the highest weight, and the
+                                 constraints of up to k violated groups are added per round. The problem is then
+                                 always built in the matrix form.
+        :param time_limit: wall-clock limit (in seconds) of each solve, None --> unlimited. When an integer program
+                           hits the limit, the best solution found so far is returned. When the limit is hit before
+                           any solution was found, the linear relaxation is solved and rounded (c.f. self.solve).
+        :param mip_rel_gap: relative gap between the objective and the best bound, at which the solver of an integer
+                            program may stop. None --> the default of the solver.
         """
+        allowed_formulations = ["pulp", "matrix"]
+        if formulation not in allowed_formulations:
+            raise TypeError("For the formulation the only acceptable values are {}. "
+                            "Given:{}".format(allowed_formulations, formulation))
 
-        if len(institution.person_lst) < B:
-            self.B = len(institution.person_lst)  # number of allotted tests
-            print("Warning: The budget of B={} cannot be exploited since there are only "
-                  "{} people in the organization. The budget was therefore "
-                  "truncated to {}".format(B,self.B,self.B))
-        else:
-            self.B = B
-
+        self.B = None  # number of allotted tests, set by self.set_budget
         self.institution = institution
         self.integer_programming = integer_programming
+        self.normalized_coverage = normalized_coverage
+        self.secondary_objective_coefficient = secondary_objective_coefficient
+        self.solver_backend = solver_backend
+        self.solver_status = 0
+        self.solver_iterations = None  # reported by the solver backend on the last solve
+        self.solution_gap = None       # relative gap of the last selection from the best bound, None if unknown
+        self.relaxation_objective = None  # objective of the fractional solution that the last selection was rounded from
+        self.time_limit = time_limit
+        self.mip_rel_gap = mip_rel_gap
+        self.warm_start = warm_start
+        self.backend = solver_backend if isinstance(solver_backend, SolverBackend) else None  # c.f. self.get_backend
+        self.formulation = formulation
+        self.problem = None      # pulp LpProblem, c.f. self.get_pulp_problem
+        self.x = None            # pulp variables of the people (a dictionary keyed by the person index)
+        self.z = None            # pulp variable of the minimal group coverage
+        self.matrix_form = None  # the problem in a matrix form, c.f. self.get_matrix_form
+        self.presolve = presolve
+        self.person_class = None  # class index of every person (-1 for people left out of the problem)
+        self.class_size = None    # number of people in every class
+        self.rounding_trials = rounding_trials
+        self.rounding_seed = rounding_seed
+        self.lazy_constraints = lazy_constraints
+        self.column_coverage_matrix = None    # c.f. self.build_columns
+        self.column_upper_bound = None
+        self.constrained_group_idx_arr = None  # the groups whose constraints are in the matrix form
+
+        # Group coverages c(e) = <x,w>/W, as a (groups x people) matrix of the coefficients of x
+        self.coverage_matrix = self.build_coverage_matrix()
+        # Must avoid constraining on the non-risky groups: only groups with a weight of at least 1/(2|V|) * sum_all_weights
+        self.active_group_mask = institution.wE >= (0.5 / len(institution.person_lst)) * institution.w.sum()
+        # Primary objective - fairness; Secondary objective - sum of coverages
+        self.regularizer = secondary_objective_coefficient / ( len(institution.group_lst)) if len(institution.group_lst) != 0 else 0.1
+
+        if presolve:
+            self.person_class, self.class_size = self.build_person_classes()
+        if formulation == "pulp" and not presolve and lazy_constraints == 0:
+            self.build_pulp_problem()
+        # otherwise, the matrix form is built upon its first use (c.f. self.get_matrix_form)
+        self.set_budget(B)
+
+    def build_coverage_matrix(self) -> sp.csr_matrix:
+        """
+        :return: sparse (groups x people) matrix, whose entry (e, v) is the contribution of person v to the
+                 coverage of group e: w(v) if the coverage isn't normalized, w(v)/W(e) if it is (0 if W(e) = 0).
+        """
+        coverage_matrix = sp.csr_matrix(self.institution.incidence_csc.T, dtype=np.float64)
+        coverage_matrix.data = self.institution.w[coverage_matrix.indices]
+        if self.normalized_coverage:
+            group_weight = self.institution.wE
+            inv_group_weight = np.divide(1.0, group_weight, out=np.zeros_like(group_weight), where=group_weight != 0)
+            coverage_matrix = sp.csr_matrix(sp.diags(inv_group_weight).dot(coverage_matrix))
+        return coverage_matrix
+
+    def build_person_classes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Partitions the people of non-zero weight into classes of interchangeable people - people who belong to the
+        very same groups and have the very same weight contribute identically to every coverage, so only the number
+        of selected people of each class matters.
+        :return: a tuple (person_class, class_size): a 1D array of the class index of every person (-1 for the
+                 people of zero weight, who contribute nothing and are left out), and a 1D array of the class sizes.
+        """
+        incidence = self.institution.incidence
+        person_class = np.full(len(self.institution.person_lst), -1, dtype=np.int64)
+        class_idx_dict = {}
+        for person_idx in np.flatnonzero(self.institution.w > 0).tolist():
+            groups = incidence.indices[incidence.indptr[person_idx]:incidence.indptr[person_idx + 1]]
+            key = (groups.tobytes(), self.institution.w[person_idx])
+            person_class[person_idx] = class_idx_dict.setdefault(key, len(class_idx_dict))
+        class_size = np.bincount(person_class[person_class >= 0], minlength=len(class_idx_dict))
+        return person_class, class_size
+
+    def expand_class_values(self, class_values: np.ndarray) -> np.ndarray:
+        """
+        Deterministically spreads the values of the class variables over the people of each class: the people of
+        a class are taken by the order of their indices, the first floor(y) of them get 1, the next one gets
+        the fractional part of y, and the rest get 0 (y being the value of the class variable).
+        :param class_values: 1D array of the values of the class variables
+        :return: 1D array of the values of the people, ordered by the person index
+        """
+        member_mask = self.person_class >= 0
+        person_idx_arr = np.flatnonzero(member_mask)
+        # rank of every person within the class (the classes are stably sorted, so the ranks follow the person indices)
+        order = np.argsort(self.person_class[member_mask], kind="stable")
+        class_start = np.concatenate([[0], np.cumsum(self.class_size)[:-1]])
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - class_start[self.person_class[member_mask][order]]
+        x = np.zeros(len(self.institution.person_lst))
+        x[person_idx_arr] = np.clip(class_values[self.person_class[member_mask]] - rank, 0.0, 1.0)
+        return x
+
+    def build_pulp_problem(self):
+        """
+        Builds self.problem, self.x and self.z from pulp expressions.
+        """
+        institution = self.institution
         self.problem = pl.LpProblem("Institution_People_Sampling_for_CoVID-19_Testing", sense=pl.LpMaximize)
-        self.x = pl.LpVariable.dicts("x", list(institution.person_idx_to_name_dict.keys()), lowBound=0.0, upBound=1.0, cat=pl.LpBinary if integer_programming else pl.LpContinuous)#, cat=pl.LpBinary) #TODO UNCOMMMENT ME if you wish to revert to Integer programming
+        self.x = pl.LpVariable.dicts("x", list(institution.person_idx_to_name_dict.keys()), lowBound=0.0, upBound=1.0, cat=pl.LpBinary if self.integer_programming else pl.LpContinuous)#, cat=pl.LpBinary) #TODO UNCOMMMENT ME if you wish to revert to Integer programming
         self.z = pl.LpVariable("z", cat=pl.LpContinuous)
 
         # Compute group coverages c(e) = <x,w>/W
         group_coverage = {}
-        average_person_weight = sum(institution.nodes_attributes[person]['w'] for person in institution.person_lst)
         for group_idx, group in enumerate(institution.group_lst):
 
-            group_people_name_lst = list(institution.G.neighbors(group))
-            group_people_var_lst = [self.x[institution.person_name_to_idx_dict[person]] for person in group_people_name_lst]
-            if normalized_coverage:
-                group_people_weight_lst = [institution.G.nodes[person]['w'] / institution.G.nodes[group]['w'] if institution.G.nodes[group]['w'] != 0 else 0.0 for person in group_people_name_lst]
+            group_people_idx_lst = institution.get_people_idx_of_one_group(group_idx).tolist()
+            group_people_var_lst = [self.x[person_idx] for person_idx in group_people_idx_lst]
+            group_weight = institution.wE[group_idx]
+            if self.normalized_coverage:
+                group_people_weight_lst = (institution.w[group_people_idx_lst] / group_weight).tolist() if group_weight != 0 else [0.0] * len(group_people_idx_lst)
             else:
-                group_people_weight_lst = [institution.G.nodes[person]['w'] for person in group_people_name_lst]
+                group_people_weight_lst = institution.w[group_people_idx_lst].tolist()
             group_coverage[group] = pl.lpDot(group_people_var_lst, group_people_weight_lst)
 
             # FOR EVERY GROUP set a constraint c(e) <= z
-            if institution.G.nodes[group]['w'] >= (0.5 / len(institution.person_lst))*average_person_weight: # must avoid constraining on the non-risky groups TODO: change the 0.0 to a 1/(2|V|) * sum_all_weights
+            if self.active_group_mask[group_idx]:
                 self.problem += group_coverage[group] >= self.z, "group_{}_coverage".format(group_idx)
 
 
         # Sum of the sampled person must not exceed the number of allotted tests (B)
-        self.problem += pl.lpSum(self.x[pid] for pid in list(institution.person_idx_to_name_dict.keys())) <= self.B, "Constraint_on_the_maximum_number_of_tests"
+        self.problem += pl.lpSum(self.x[pid] for pid in list(institution.person_idx_to_name_dict.keys())) <= (0 if self.B is None else self.B), "Constraint_on_the_maximum_number_of_tests"
 
         # Primary objective - fairness; Secondary objective - sum of coverages
-        regularizer = secondary_objective_coefficient / ( len(institution.group_lst)) if len(institution.group_lst) != 0 else 0.1
-        self.problem += self.z + regularizer * pl.lpSum(group_coverage.values())
+        self.problem += self.z + self.regularizer * pl.lpSum(group_coverage.values())
+
+    def build_columns(self):
+        """
+        Builds self.column_coverage_matrix and self.column_upper_bound - the coverage coefficients and the upper
+        bounds of the variables of the matrix form (of the people, or of the classes of people with presolve).
+        """
+        if self.presolve:
+            class_idx_arr, first_member_idx_arr = np.unique(self.person_class, return_index=True)
+            self.column_coverage_matrix = sp.csr_matrix(self.coverage_matrix.tocsc()[:, first_member_idx_arr[class_idx_arr >= 0]])
+            self.column_upper_bound = self.class_size.astype(np.float64)
+        else:
+            self.column_coverage_matrix = self.coverage_matrix
+            self.column_upper_bound = np.ones(len(self.institution.person_lst))
+
+    def build_group_constraint_rows(self, group_idx_arr: np.ndarray) -> sp.csr_matrix:
+        """
+        :param group_idx_arr: 1D array of group indices
+        :return: the rows of the constraints z - c(e) <= 0 of the given groups, in a matrix form
+        """
+        if self.column_coverage_matrix is None:
+            self.build_columns()
+        group_coverage_matrix = self.column_coverage_matrix[group_idx_arr]
+        return sp.hstack([-group_coverage_matrix, sp.csr_matrix(np.ones((len(group_idx_arr), 1)))], format="csr")
+
+    def build_matrix_form(self, group_idx_arr: Union[np.ndarray, None] = None) -> MatrixForm:
+        """
+        Builds the problem in a matrix form directly from the coverage matrix (without pulp expressions).
+        The variables are [x_0, ..., x_(|V|-1), z], and the problem is:
+            minimize  -(z + regularizer * sum_e c(e))
+            subject to  sum_v x_v <= B,  z - c(e) <= 0  for every active group e,  0 <= x_v <= 1
+        With presolve, the variables are [y_0, ..., y_(K-1), z] instead - one per class of interchangeable people,
+        bounded by the class size (0 <= y_k <= |class k|), whose coverage coefficients are those of any class member.
+        :param group_idx_arr: 1D array of the indices of the groups to constrain (None --> all the active groups)
+        :return: MatrixForm, whose first row is the budget constraint, followed by the group constraints
+        """
+        if self.column_coverage_matrix is None:
+            self.build_columns()
+        if group_idx_arr is None:
+            group_idx_arr = np.flatnonzero(self.active_group_mask)
+        num_columns = self.column_coverage_matrix.shape[1]
+        A_ub = sp.vstack([sp.hstack([sp.csr_matrix(np.ones((1, num_columns))), sp.csr_matrix((1, 1))]),
+                          self.build_group_constraint_rows(group_idx_arr)], format="csr")
+        b_ub = np.zeros(len(group_idx_arr) + 1, dtype=np.float64)
+        b_ub[0] = 0 if self.B is None else self.B
+        c = -np.append(self.regularizer * np.asarray(self.column_coverage_matrix.sum(axis=0)).ravel(), 1.0)
+        lb = np.append(np.zeros(num_columns), -np.inf)
+        ub = np.append(self.column_upper_bound, np.inf)
+        integrality = np.append(np.full(num_columns, 1 if self.integer_programming else 0), 0).astype(np.int8)
+        self.constrained_group_idx_arr = group_idx_arr
+        return MatrixForm(c, A_ub, b_ub, lb, ub, integrality, budget_row=0)
+
+    def add_group_constraints(self, group_idx_arr: np.ndarray):
+        """
+        Extends the matrix form by the constraints of the given groups (appended as the last rows, so that a solver
+        backend may add them to its loaded model instead of reloading it, c.f. MatrixForm.base).
+        :param group_idx_arr: 1D array of the indices of the (so far unconstrained) groups to constrain
+        """
+        matrix_form = self.get_matrix_form()
+        self.matrix_form = MatrixForm(matrix_form.c,
+                                      sp.vstack([matrix_form.A_ub, self.build_group_constraint_rows(group_idx_arr)],
+                                                format="csr"),
+                                      np.append(matrix_form.b_ub, np.zeros(len(group_idx_arr))),
+                                      matrix_form.lb, matrix_form.ub, matrix_form.integrality,
+                                      budget_row=matrix_form.budget_row, base=matrix_form)
+        matrix_form.base = None  # only the last extension is of interest, keep no longer chains of matrix forms
+        self.constrained_group_idx_arr = np.append(self.constrained_group_idx_arr, group_idx_arr)
+        self.problem = None  # the pulp problem (if required) is derived from the extended matrix form
+
+    def solve_with_lazy_constraints(self, backend: SolverBackend, verbosity: int = 0) -> SolverResult:
+        """
+        Constraint generation: solves the problem with the constraints of only some of the groups (initially, the
+        self.lazy_constraints active groups of the highest weight), then checks the coverages of all the active
+        groups at once, and adds the constraints of (up to self.lazy_constraints of) the most violated groups.
+        Repeats until no constraint is violated - hence the solution is optimal for the full problem as well.
+        The constrained groups are kept between solves (e.g. of different budgets).
+        :return: SolverResult of the last solve (with the total number of iterations)
+        """
+        active_group_idx_arr = np.flatnonzero(self.active_group_mask)
+        if self.column_coverage_matrix is None:
+            self.build_columns()
+        active_coverage_matrix = self.column_coverage_matrix[active_group_idx_arr]
+        total_iterations = None
+        while True:
+            result = backend.solve(self, verbosity=verbosity)
+            if result.iterations is not None:
+                total_iterations = (total_iterations or 0) + result.iterations
+            if result.status != 1:
+                if result.status == 2:
+                    result.gap = None  # the solver bounded only the partially constrained problem
+                return result
+            group_coverage = active_coverage_matrix.dot(result.x)
+            violation = result.z - group_coverage
+            violation[np.isin(active_group_idx_arr, self.constrained_group_idx_arr)] = 0.0
+            violated_idx_arr = np.flatnonzero(violation > 1e-9 * max(1.0, abs(result.z)))
+            if len(violated_idx_arr) == 0:
+                result.iterations = total_iterations
+                return result
+            most_violated_idx_arr = violated_idx_arr[np.argsort(-violation[violated_idx_arr], kind="stable")]
+            if verbosity > 0:
+                print("{} group constraints are violated, adding {} of them".format(
+                    len(violated_idx_arr), min(len(violated_idx_arr), self.lazy_constraints)))
+            self.add_group_constraints(active_group_idx_arr[most_violated_idx_arr[:self.lazy_constraints]])
+
+    def set_budget(self, B: int):
+        """
+        Sets the maximum number of allowed tests. Only the right-hand side of the budget constraint
+        is changed, so the same problem can be re-solved for many budgets without being rebuilt.
+        :param B: maximum number of allowed tests (budget)
+        """
+        if len(self.institution.person_lst) < B:
+            self.B = len(self.institution.person_lst)
+            print("Warning: The budget of B={} cannot be exploited since there are only "
+                  "{} people in the organization. The budget was therefore "
+                  "truncated to {}".format(B,self.B,self.B))
+        else:
+            self.B = B
+        if self.problem is not None:
+            # pulp keeps "expression <= B" as "expression - B <= 0"
+            self.problem.constraints["Constraint_on_the_maximum_number_of_tests"].constant = -self.B
+        if self.matrix_form is not None:
+            self.matrix_form.b_ub[self.matrix_form.budget_row] = self.B
+
+    def selection_vector(self, sampled_person_lst: list) -> np.ndarray:
+        """
+        :param sampled_person_lst: list (of strings) of people chosen for testing
+        :return: 1D array of the selection values of the people (1 - chosen, 0 - not chosen), ordered by the person index
+        """
+        x = np.zeros(len(self.institution.person_lst))
+        x[[self.institution.person_name_to_idx_dict[person] for person in sampled_person_lst]] = 1.0
+        return x
+
+    def objective_value(self, x: np.ndarray) -> Tuple[float, float]:
+        """
+        Evaluates the objective of the problem for a given (possibly fractional) selection.
+        :param x: 1D array of the selection values of the people, ordered by the person index
+        :return: a tuple (z, objective), where z is the minimal coverage among the active groups (0 if there are none)
+                 and objective = z + regularizer * sum of the coverages of all the groups
+        """
+        group_coverage = self.coverage_matrix.dot(x)
+        z = group_coverage[self.active_group_mask].min() if self.active_group_mask.any() else 0.0
+        return z, z + self.regularizer * group_coverage.sum()
+
+    def get_pulp_problem(self) -> pl.LpProblem:
+        """
+        :return: the problem as a pulp LpProblem (built from the matrix form, if it wasn't built yet)
+        """
+        if self.problem is None:
+            self.problem, variables = matrix_form_to_pulp_problem(self.get_matrix_form(),
+                                                                  "Institution_People_Sampling_for_CoVID-19_Testing",
+                                                                  "Constraint_on_the_maximum_number_of_tests")
+            self.x = dict(enumerate(variables[:-1]))
+            self.z = variables[-1]
+        return self.problem
+
+    def get_matrix_form(self) -> MatrixForm:
+        """
+        :return: the problem in a matrix form (variables ordered as the person indices, followed by z)
+        """
+        if self.matrix_form is None and self.problem is None and self.lazy_constraints > 0:
+            active_group_idx_arr = np.flatnonzero(self.active_group_mask)
+            heaviest_group_idx_arr = active_group_idx_arr[np.argsort(-self.institution.wE[active_group_idx_arr],
+                                                                     kind="stable")[:self.lazy_constraints]]
+            self.matrix_form = self.build_matrix_form(np.sort(heaviest_group_idx_arr))
+        elif self.matrix_form is None and self.problem is None:
+            self.matrix_form = self.build_matrix_form()
+        elif self.matrix_form is None:
+            variables = [self.x[person_idx] for person_idx in range(len(self.x))] + [self.z]
+            self.matrix_form = pulp_problem_to_matrix_form(self.problem, variables,
+                                                           "Constraint_on_the_maximum_number_of_tests")
+        return self.matrix_form
 
     def __str__(self):
         return "People Selection Linear Program with the " \
-               "following parameters:\n B={}:\n{}".format(self.B,self.problem)
+               "following parameters:\n B={}:\n{}".format(self.B,self.get_pulp_problem())
+
+    def get_backend(self, path="") -> SolverBackend:
+        """
+        The solver backend is created once per problem, so that it may keep its state (e.g. a loaded model and a
+        basis to warm start from) between consecutive solves.
+        :param path: a path to the solver executable (only used by the "glpk" solver backend)
+        """
+        if self.backend is None or (not isinstance(self.solver_backend, SolverBackend) and
+                                    getattr(self.backend, "path", path) != path):
+            self.backend = make_solver_backend(self.solver_backend, path, warm_start=self.warm_start)
+        return self.backend
 
     def solve(self, path= "", verbosity=0):
         """
         Solves the LP problem and returns the list of people chosen for sampling.
+        :param path: a path to the solver executable (only used by the "glpk" solver backend)
         :param verbosity: 0 - no messages, 1 - only python messages, 2 - python and solver messages
         :return: list of person chosen for sampling, or None if failed
         """
+        backend = self.get_backend(path)
         try:
-            self.problem.solve(pl.GLPK_CMD(msg=verbosity, path= None if path == "" else path)) # TODO allow other solvers
+            if self.lazy_constraints > 0:
+                result = self.solve_with_lazy_constraints(backend, verbosity=verbosity)
+            else:
+                result = backend.solve(self, verbosity=verbosity)
             solver_crashed = False
         except:
             solver_crashed = True
-			
-        if not solver_crashed and self.problem.status == 1:
-            sampled_person_lst = []
-            person_idx_to_x_value_dict = {person_id:pl.value(x) for person_id, x in sorted(self.x.items())}
-            for person_idx, x_value in sorted(person_idx_to_x_value_dict.items()):
-                person = self.institution.person_idx_to_name_dict[person_idx]
-                if self.integer_programming:
-                    sampled = x_value
-                    if verbosity > 0:
-                        print("person {} : {}".format(person, pl.value(x_value)))
-                else: # Requires randomized rounding
-                    sampled = np.random.binomial(1, pl.value(x_value))
-                    if verbosity > 0:
-                        print("person {:25} : {} randomly rounded to {} ".format(person, x_value, sampled))
-                if sampled:
-                    sampled_person_lst.append(person)
-
-            # if the number of sampled people is different than B - add/remove people as required to reach exactly B:
-            sampled_person_lst = self.refine_sampled_person_lst(sampled_person_lst, person_idx_to_x_value_dict,
-                                                                verbosity=verbosity)
+
+        rounded = not self.integer_programming
+        if self.time_limit is not None and (solver_crashed or result.status not in (1, 2)):
+            # the time limit was reached before any solution was found (the LP solvers don't keep a feasible solution
+            # of an unfinished solve) - fall back to the rounded relaxation
+            if verbosity > 0:
+                print("No solution was found within the time limit, rounding the linear relaxation")
+            try:
+                result = self.solve_relaxation(path, verbosity=verbosity)
+                solver_crashed = result.status != 1
+                result.status = 2
+                rounded = True
+            except:
+                solver_crashed = True
+
+        self.solver_status = -1 if solver_crashed else result.status
+        self.solver_iterations = None if solver_crashed else result.iterations
+        self.solution_gap = None if solver_crashed else result.gap
+        self.relaxation_objective = None
+        if not solver_crashed and result.status in (1, 2):
+            x = self.expand_class_values(result.x) if self.presolve else result.x
+            if rounded:  # Requires randomized rounding
+                selected = self.round_solution(x)
+                # the relaxation bounds the objective of any selection, report the gap of the rounded one
+                self.relaxation_objective = self.objective_value(x)[1]
+                self.solution_gap = relative_gap(-self.objective_value(selected.astype(np.float64))[1],
+                                                 -self.relaxation_objective)
+            else:
+                selected = x > 0.5
+            sampled_person_lst = [self.institution.person_idx_to_name_dict[person_idx]
+                                  for person_idx in np.flatnonzero(selected).tolist()]
+            if verbosity > 0:
+                for person_idx, (x_value, sampled) in enumerate(zip(x.tolist(), selected.tolist())):
+                    print("person {:25} : {} rounded to {} ".format(self.institution.person_idx_to_name_dict[person_idx],
+                                                                     x_value, int(sampled)))
 
             # Report the sampled people
             num_selected_people = len(sampled_person_lst)
             if verbosity > 0:
-                print("Found a solution (z={}): People chosen for sampling".format(pl.value(self.z)))
+                print("Found a solution (z={}): People chosen for sampling".format(result.z))
                 print(sampled_person_lst)
                 print("-" * 72)
                 print("The solution selected {} {} (B was set to {})".format(num_selected_people, "person" if num_selected_people == 1 else "people", self.B))
+                if result.status == 2:
+                    print("The solver stopped at the time limit, the gap of the solution is {}".format(
+                        "unknown" if self.solution_gap is None else "{:.2%}".format(self.solution_gap)))
             return sampled_person_lst
         else:
             if verbosity > 0:
@@ -114,43 +452,76 @@ class SelectCandidatesForTest:
             return None
 
     def status(self):
-        return self.problem.status
-
-    def refine_sampled_person_lst(self, sampled_person_lst : list, person_idx_to_x_value_dict : dict, verbosity : int):
-        """
-        If, as a result of the linear problem solution, the number of sampled people is not exactly B,
-        this function will attempt to bring it as close to B as possible.
-        :param sampled_person_lst: list (of strings) of people that were chosen for testing by the solver.
-        :param person_idx_to_x_value_dict: a dictionary where person indices are the keys and the values are the
-                                       optimization variables.
-        :param verbosity: integer, any positive value will allow messages to be printed to the stdout.
-        :return: a refined list of people chosen for testing.
-        """
-        num_selected_people = len(sampled_person_lst)
-        if not self.integer_programming and num_selected_people != self.B:
-            if verbosity > 0: print("Number of chosen people {} doesn't "
-                                    "correspond to budget B={}. Starting "
-                                    "refinements...".format(num_selected_people, self.B))
-            if num_selected_people > self.B:
-                sampled_person_lst_ordered_by_score = [self.institution.person_idx_to_name_dict[person_idx] for person_idx, value
-                                                       in sorted(person_idx_to_x_value_dict.items(), key=lambda item: item[1])
-                                                       if self.institution.person_idx_to_name_dict[person_idx] in sampled_person_lst]
-                while len(sampled_person_lst_ordered_by_score) > self.B:  # continue removing people with ascending score
-                    person = sampled_person_lst_ordered_by_score.pop(0)
-                    if verbosity > 0:
-                        print(" - Removing person named {}".format(person))
-                sampled_person_lst = sampled_person_lst_ordered_by_score
-            elif num_selected_people < self.B:
-                unsampled_person_lst_ordered_by_score = [self.institution.person_idx_to_name_dict[person_idx] for person_idx, value
-                                                         in sorted(person_idx_to_x_value_dict.items(), key=lambda item: item[1])
-                                                         if self.institution.person_idx_to_name_dict[person_idx] not in sampled_person_lst]
-                while len(sampled_person_lst) < self.B and len(unsampled_person_lst_ordered_by_score) > 0:
-                    person = unsampled_person_lst_ordered_by_score.pop(-1)
-                    sampled_person_lst.append(person)
-                    if verbosity > 0:
-                        print(" - Adding person named {}".format(person))
-        return sampled_person_lst
+        return self.solver_status
 
+    def solve_relaxation(self, path="", verbosity=0) -> SolverResult:
+        """
+        Solves the linear relaxation of the (integer) problem, by a fresh solver backend (unless a SolverBackend
+        instance was given), leaving this problem and its backend untouched. The relaxation is solved without a time
+        limit, as it serves as the fallback of a program that ran out of time.
+        :param path: a path to the solver executable (only used by the "glpk" solver backend)
+        :param verbosity: 0 - no messages, 1 - only python messages, 2 - python and solver messages
+        :return: SolverResult of the relaxation
+        """
+        matrix_form = self.get_matrix_form()
+        relaxation = copy.copy(self)
+        relaxation.integer_programming = False
+        relaxation.time_limit = None
+        relaxation.problem = None  # derived from the relaxed matrix form, if required
+        relaxation.matrix_form = MatrixForm(matrix_form.c, matrix_form.A_ub, matrix_form.b_ub, matrix_form.lb,
+                                            matrix_form.ub, np.zeros_like(matrix_form.integrality),
+                                            budget_row=matrix_form.budget_row)
+        relaxation.backend = self.backend if isinstance(self.solver_backend, SolverBackend) else None
+        backend = relaxation.get_backend(path)
+        if self.lazy_constraints > 0:
+            return relaxation.solve_with_lazy_constraints(backend, verbosity=verbosity)
+        return backend.solve(relaxation, verbosity=verbosity)
 
+    def round_solution(self, x: np.ndarray) -> np.ndarray:
+        """
+        Randomized rounding of a fractional solution. Draws self.rounding_trials independent roundings (each person
+        is selected with probability x_v), brings each of them to exactly B people - by dropping the selected people
+        of the lowest x values, or by adding the unselected people of the highest x values - and keeps the rounding
+        of the highest objective. The trials are processed in chunks (in parallel threads), each chunk with its own
+        random generator, spawned from self.rounding_seed and B - so the result is reproducible for a given seed,
+        regardless of the number of threads and of the order in which the budgets are solved.
+        :param x: 1D array of the values of the people, ordered by the person index
+        :return: 1D boolean array, True for the people selected for testing
+        """
+        num_people = len(x)
+        probability = np.clip(x, 0.0, 1.0)
+        chunk_size = 8
+        num_chunks = (self.rounding_trials + chunk_size - 1) // chunk_size
+        entropy = None if self.rounding_seed is None else [self.rounding_seed, self.B]
+        seed_sequence_lst = np.random.SeedSequence(entropy).spawn(num_chunks)
 
+        def round_chunk(chunk_idx: int) -> Tuple[float, np.ndarray]:
+            rng = np.random.default_rng(seed_sequence_lst[chunk_idx])
+            num_trials = min(chunk_size, self.rounding_trials - chunk_idx * chunk_size)
+            selected = rng.random((num_trials, num_people)) < probability
+            if self.B == 0:
+                selected[:] = False
+            elif self.B < num_people:
+                # the sampled people come first (by their x value), then the rest (by their x value)
+                priority = np.where(selected, probability + 2.0, probability)
+                top = np.argpartition(-priority, self.B - 1, axis=1)[:, :self.B]
+                selected = np.zeros_like(selected)
+                np.put_along_axis(selected, top, True, axis=1)
+            else:
+                selected[:] = True
+            group_coverage = self.coverage_matrix.dot(selected.T.astype(np.float64))  # (groups x trials)
+            if self.active_group_mask.any():
+                z = group_coverage[self.active_group_mask].min(axis=0)
+            else:
+                z = np.zeros(num_trials)
+            objective = z + self.regularizer * group_coverage.sum(axis=0)
+            best_trial = int(np.argmax(objective))
+            return objective[best_trial], selected[best_trial]
 
+        if num_chunks == 1:
+            chunk_result_lst = [round_chunk(0)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(num_chunks, os.cpu_count() or 1)) as executor:
+                chunk_result_lst = list(executor.map(round_chunk, range(num_chunks)))
+        # the first chunk wins ties, so the result does not depend on the scheduling of the threads
+        return max(chunk_result_lst, key=lambda chunk_result: chunk_result[0])[1]
@@ -1,6 +1,11 @@
 import argparse
 import datetime
 from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+NO_DATE = np.iinfo(np.int32).min  # the day of a missing date, c.f. strdates_to_days
 
 
 def check_strdate(value):
@@ -43,3 +48,34 @@ class MyDate:
             return (self.pydate - timedelta(days=other)).days
         else:
             raise NotImplemented("MyDate : the subtraction is implemented onl for MyDate-int MyDate-datetime.date, Mydate-MyDate")
+
+    @property
+    def days(self) -> int:
+        """
+        The number of days since the epoch (1970-01-01)
+        """
+        return self.pydate.toordinal() - EPOCH_ORDINAL
+
+
+def days_to_mydate(days: int):
+    """
+    :param days: number of days since the epoch (c.f. MyDate.days), or NO_DATE
+    :return: the MyDate object of that day, or None for NO_DATE
+    """
+    if days == NO_DATE:
+        return None
+    return MyDate(pydate=datetime.date.fromordinal(int(days) + EPOCH_ORDINAL))
+
+
+def strdates_to_days(strdates) -> np.ndarray:
+    """
+    Parses a column of date strings (formatted as YYYY-MM-DD) into days since the epoch (c.f. MyDate.days).
+    Each distinct date string is validated and parsed once.
+    :param strdates: iterable (or pandas Series) of date strings, where an empty string (or a null) stands for a
+                     missing date
+    :return: 1D int32 array, with NO_DATE for the missing dates
+    """
+    codes, unique_strdates = pd.factorize(pd.Series(strdates, dtype=object))
+    unique_days = np.array([MyDate(strdate=strdate).days if strdate != "" else NO_DATE
+                            for strdate in unique_strdates] + [NO_DATE], dtype=np.int32)
+    return unique_days[codes]  # the code of a null is -1, i.e. the trailing NO_DATE
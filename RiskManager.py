@@ -1,8 +1,13 @@
 from typing import Tuple, List, Union
+import copy
+import os
+import threading
 import numpy as np
 import yaml
 
-from Util.numeric import floatify_string, modified_sigmoid
+from Util.numeric import floatify_string, modified_sigmoid_vector
+
+DISCOUNT_TABLE_MAX_DAYS = 3650  # the longest per-day discount table, c.f. RiskManager.get_discount_table
 
 
 class RiskManager:
@@ -18,6 +23,7 @@ class RiskManager:
         self.coeff_vector = None
         self.discount_kind = None
         self.discount_vector = None
+        self._discount_table = None  # compiled from the discount configuration, c.f. get_discount_table
 
         if load_path != "":
             self.load(load_path)
@@ -58,12 +64,17 @@ class RiskManager:
                 raise DiscountArgSigmoidException(discount_vector)
             else:
                 self.discount_vector = discount_vector
+        self._discount_table = None
 
-    def get_discount(self, time_elapsed: int) -> float:
+    def get_discount_table(self) -> Union[np.ndarray, None]:
         """
-        Return a discount factor for a given "time elapsed" value
-        :param time_elapsed:
-        :return:
+        Compiles the discount configuration into a per-day lookup table (once per configuration, the table is
+        rebuilt after set_discount or load): entry d of the table is the discount after d days, and the last entry
+        is also the discount of all the later days.
+        For a "custom" kind, that is the discount vector followed by 1.0. For a "sigmoid" kind, the table ends at the
+        first day at which the sigmoid equals 1.0 (in float64) - there is no table (None) if this takes more than
+        DISCOUNT_TABLE_MAX_DAYS days, or never happens (a non-positive coefficient).
+        :return: 1D float64 array, or None
         """
         if self.discount_kind is None:
             raise ConfigurationKindException("Discount")
@@ -71,35 +82,56 @@ class RiskManager:
             raise ConfigurationArrayMissingException(
                 "Discount kind", self.discount_kind)
 
-        if self.discount_kind == "sigmoid":
-            # a,b
-            coefficient, shift = self.discount_vector[0], self.discount_vector[1]
-            return modified_sigmoid(x=time_elapsed, coefficient=coefficient, shift=shift)
-        elif self.discount_kind == "custom":
-            if time_elapsed >= len(self.discount_vector):
-                return 1.0
-            elif time_elapsed < 0:
-                return 0.0
-            else:
-                return self.discount_vector[time_elapsed]
+        if self._discount_table is None:
+            if self.discount_kind == "custom":
+                self._discount_table = np.append(self.discount_vector.astype(np.float64), 1.0)
+            elif self.discount_kind == "sigmoid":
+                coefficient, shift = self.discount_vector[0], self.discount_vector[1]
+                # beyond shift + 40/coefficient, exp(-coefficient*(x-shift)) < 2^-53, so the sigmoid rounds to 1.0
+                if coefficient > 0 and shift + 40.0 / coefficient < DISCOUNT_TABLE_MAX_DAYS:
+                    num_days = max(int(np.ceil(shift + 40.0 / coefficient)), 0) + 1
+                    self._discount_table = modified_sigmoid_vector(np.arange(num_days), coefficient=coefficient,
+                                                                   shift=shift)
+        return self._discount_table
+
+    def get_discount(self, time_elapsed: int) -> float:
+        """
+        Return a discount factor for a given "time elapsed" value
+        :param time_elapsed:
+        :return:
+        """
+        return float(self.get_discounts(np.array([time_elapsed]))[0])
 
     def get_discounts(self, vector_time_elapsed: Union[np.ndarray, List, Tuple]) -> Union[np.ndarray, None]:
         """
-        :param vector_time_elapsed: list or 1D numpy array of values
-        :return: numpy 1D array of coefficients, of a length specified by num_coefficients
-                 if num_coefficients is larger than the number of "custom" exiting coefficients,
-                 the missing most significant coefficients will be the replica of the
-                 most significant existing coefficient. If num_coefficients is smaller than the
-                 number of existing coefficients, then num_coefficients least signifficant coefficients
-                 will be truncated and returned.
+        Maps the time elapsed values to their discounts by a lookup in the discount table (c.f. get_discount_table),
+        in a single vectorized operation.
+        :param vector_time_elapsed: list or 1D numpy array of values (days)
+        :return: numpy 1D array of discounts, one per value of vector_time_elapsed. For a "custom" kind, negative
+                 values are discounted by 0.0 and the values beyond the discount vector by 1.0.
         """
-        if type(vector_time_elapsed) is list:
-            return np.array(list(map(self.get_discount, vector_time_elapsed)))
-        elif type(vector_time_elapsed) is np.ndarray and 1 == len(vector_time_elapsed.shape):
-            return np.apply_along_axis(self.get_discount, 0, vector_time_elapsed)
-        else:
+        if type(vector_time_elapsed) in [list, tuple]:
+            vector_time_elapsed = np.array(vector_time_elapsed)
+        if type(vector_time_elapsed) is not np.ndarray or 1 != len(vector_time_elapsed.shape):
             return None
 
+        discount_table = self.get_discount_table()
+        if self.discount_kind == "custom":
+            time_elapsed = vector_time_elapsed.astype(np.int64)
+            discounts = discount_table[np.clip(time_elapsed, 0, len(discount_table) - 1)]
+            discounts[time_elapsed < 0] = 0.0
+            return discounts
+        elif self.discount_kind == "sigmoid":
+            coefficient, shift = self.discount_vector[0], self.discount_vector[1]
+            if discount_table is None or not np.issubdtype(vector_time_elapsed.dtype, np.integer):
+                return modified_sigmoid_vector(vector_time_elapsed, coefficient=coefficient, shift=shift)
+            discounts = discount_table[np.clip(vector_time_elapsed, 0, len(discount_table) - 1)]
+            negative_mask = vector_time_elapsed < 0
+            if negative_mask.any():
+                discounts[negative_mask] = modified_sigmoid_vector(vector_time_elapsed[negative_mask],
+                                                                   coefficient=coefficient, shift=shift)
+            return discounts
+
     def set_coefficients(self, risk_factor_coeff_kind: str, arg: Union[np.ndarray, List, str, Tuple, None] = None):
         """
         Sets the risk factor coefficients.
@@ -175,6 +207,7 @@ class RiskManager:
         load the configuration from yaml file, and set them to the current object.
         :param path: str, a path to the yaml file, containing the configurations
         """
+        self._discount_table = None
         try:
             with open(path) as file:
                 documents = yaml.full_load(file)
@@ -208,6 +241,75 @@ class RiskManager:
         with open(path, 'w') as file:
             documents = yaml.dump(dict_file, file)
 
+class RiskProfileRegistry:
+    """
+    A process-wide cache of the risk profiles (the yaml configurations of RiskManager) of a directory. Each profile
+    is loaded (and its discount table compiled) once, and reloaded only after its file changes - by its modification
+    time and size - or after it is invalidated (c.f. invalidate). The listing of the directory is cached the same way.
+    The registry may be used by several threads at once.
+    """
+    def __init__(self, directory: str):
+        """
+        :param directory: the directory of the yaml configurations
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._profile_dict = {}  # filename --> (file signature, RiskManager)
+        self._listing = None     # (directory signature, list of filenames)
+
+    def get(self, filename: str) -> RiskManager:
+        """
+        :param filename: the filename of a profile (relative to self.directory)
+        :return: a RiskManager of the profile - a copy of the cached one, so it can be reconfigured (c.f.
+                 RiskManager.set_discount) without affecting the registry. Its arrays are shared with the cached
+                 one (RiskManager replaces its arrays rather than modifying them).
+        """
+        path = os.path.join(self.directory, filename)
+        try:
+            signature = file_signature(path)
+        except OSError:
+            return RiskManager(path)  # as RiskManager does, a missing profile yields an unconfigured RiskManager
+        with self._lock:
+            cached = self._profile_dict.get(filename)
+            if cached is None or cached[0] != signature:
+                risk_manager = RiskManager(path)
+                if risk_manager.discount_kind is not None and risk_manager.discount_vector is not None:
+                    risk_manager.get_discount_table()
+                cached = (signature, risk_manager)
+                self._profile_dict[filename] = cached
+        return copy.copy(cached[1])
+
+    def invalidate(self, filename: str = None):
+        """
+        Drops a profile from the cache (e.g. after it was saved), along with the cached listing of the directory.
+        :param filename: the filename of a profile, None --> all the profiles
+        """
+        with self._lock:
+            if filename is None:
+                self._profile_dict.clear()
+            else:
+                self._profile_dict.pop(filename, None)
+            self._listing = None
+
+    def list_profiles(self) -> List[str]:
+        """
+        :return: the filenames of the files in self.directory
+        """
+        signature = file_signature(self.directory)
+        with self._lock:
+            if self._listing is None or self._listing[0] != signature:
+                self._listing = (signature, [f for f in os.listdir(self.directory)
+                                             if os.path.isfile(os.path.join(self.directory, f))])
+            return list(self._listing[1])
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    """
+    :return: the modification time (ns) and the size of a file (or a directory)
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
 #################################### Exceptions ####################################
 
 
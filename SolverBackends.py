@@ -0,0 +1,368 @@
+from typing import Tuple, List, Union
+import numpy as np
+import pulp as pl
+import scipy.sparse as sp
+
+
+class MatrixForm:
+    """
+    A linear program in a matrix form:  minimize c^T v  subject to  A_ub v <= b_ub,  lb <= v <= ub.
+    The variables v are ordered as [x_0, x_1, ..., x_(|V|-1), z] - one variable per person, followed by z.
+    """
+    def __init__(self, c: np.ndarray, A_ub: sp.csr_matrix, b_ub: np.ndarray, lb: np.ndarray, ub: np.ndarray,
+                 integrality: np.ndarray, budget_row: int, base=None):
+        """
+        :param c: 1D array, the objective coefficients (of a minimization)
+        :param A_ub: sparse matrix, the coefficients of the inequality constraints
+        :param b_ub: 1D array, the right-hand side of the inequality constraints
+        :param lb: 1D array, the lower bounds of the variables (-np.inf for unbounded)
+        :param ub: 1D array, the upper bounds of the variables (np.inf for unbounded)
+        :param integrality: 1D array, 1 for integer variables, 0 for continuous ones
+        :param budget_row: the index of the row of A_ub that constrains the number of tests
+        :param base: a MatrixForm of which this one is an extension by additional constraints (the rows of A_ub
+                     beyond those of the base), or None
+        """
+        self.c = c
+        self.A_ub = A_ub
+        self.b_ub = b_ub
+        self.lb = lb
+        self.ub = ub
+        self.integrality = integrality
+        self.budget_row = budget_row
+        self.base = base
+
+
+class SolverResult:
+    """
+    The outcome of a single solver run.
+    """
+    def __init__(self, status: int, x: Union[np.ndarray, None] = None, z: Union[float, None] = None,
+                 iterations: Union[int, None] = None, gap: Union[float, None] = None):
+        """
+        :param status: 1 if an optimal solution was found (same convention as pulp's LpStatusOptimal),
+                       2 if a feasible but not necessarily optimal solution was found - the solver stopped at the time
+                       limit or at the relative gap limit (same convention as pulp's LpSolutionIntegerFeasible),
+                       otherwise a non-positive value.
+        :param x: 1D array of the person variable values, ordered by the person index (or of the class variables,
+                  ordered by the class index, if the problem was presolved)
+        :param z: the value of the minimal group coverage variable
+        :param iterations: number of simplex iterations (or branch-and-bound nodes for integer programs) that the
+                           solver performed, None if the solver doesn't report it
+        :param gap: the gap between the objective of the solution and the best bound on the optimal objective,
+                    relative to the bound (0 for optimal solutions of linear programs), None if the solver doesn't
+                    report it
+        """
+        self.status = status
+        self.x = x
+        self.z = z
+        self.iterations = iterations
+        self.gap = gap
+
+
+class SolverBackend:
+    """
+    An interface of a solver for the people selection problem (c.f. LinearProgramming.SelectCandidatesForTest).
+    """
+    name = ""
+
+    def solve(self, problem, verbosity: int = 0) -> SolverResult:
+        """
+        :param problem: a SelectCandidatesForTest instance (its time_limit and mip_rel_gap are respected)
+        :param verbosity: 0 - no messages, 1 - only python messages, 2 - python and solver messages
+        :return: SolverResult
+        """
+        raise NotImplementedError
+
+
+class GlpkCmdBackend(SolverBackend):
+    """
+    Solves the pulp model of the problem by an external glpsol executable (writes an LP file, spawns
+    the solver process and parses the solution file back).
+    """
+    name = "glpk"
+
+    def __init__(self, path: str = ""):
+        """
+        :param path: a path to the glpsol executable. If empty, then glpsol is searched for in the system path.
+        """
+        self.path = path
+
+    def solve(self, problem, verbosity: int = 0) -> SolverResult:
+        pulp_problem = problem.get_pulp_problem()
+        options = []
+        if problem.time_limit is not None:
+            options += ["--tmlim", str(max(1, int(problem.time_limit)))]
+        if problem.mip_rel_gap is not None:
+            options += ["--mipgap", str(problem.mip_rel_gap)]
+        pulp_problem.solve(pl.GLPK_CMD(msg=verbosity > 1, path=None if self.path == "" else self.path, options=options))
+        if pulp_problem.status != 1:
+            return SolverResult(pulp_problem.status)
+        x = np.array([pl.value(problem.x[person_idx]) or 0.0 for person_idx in range(len(problem.x))], dtype=np.float64)
+        if getattr(pulp_problem, "sol_status", pl.LpStatusOptimal) == 2:  # integer feasible, stopped by a limit
+            return SolverResult(2, x, pl.value(problem.z))
+        return SolverResult(pulp_problem.status, x, pl.value(problem.z), gap=0.0)
+
+
+class HighsBackend(SolverBackend):
+    """
+    Solves the matrix form of the problem in-process by the HiGHS solver, via scipy.optimize.linprog
+    (for linear programs) or scipy.optimize.milp (for integer programs).
+    """
+    name = "highs"
+
+    def solve(self, problem, verbosity: int = 0) -> SolverResult:
+        from scipy.optimize import linprog, milp, LinearConstraint, Bounds
+
+        mf = problem.get_matrix_form()
+        options = {"disp": verbosity > 1}
+        if problem.time_limit is not None:
+            options["time_limit"] = problem.time_limit
+        if mf.integrality.any():
+            if problem.mip_rel_gap is not None:
+                options["mip_rel_gap"] = problem.mip_rel_gap
+            res = milp(mf.c, constraints=LinearConstraint(mf.A_ub, -np.inf, mf.b_ub), integrality=mf.integrality,
+                       bounds=Bounds(mf.lb, mf.ub), options=options)
+        else:
+            res = linprog(mf.c, A_ub=mf.A_ub, b_ub=mf.b_ub, bounds=np.column_stack((mf.lb, mf.ub)),
+                          method="highs", options=options)
+        if res.x is None:
+            return SolverResult(-1)
+        if mf.integrality.any():
+            # status 1 - the time limit (or another limit) was reached, the incumbent is returned
+            if res.status not in (0, 1):
+                return SolverResult(-1)
+            return SolverResult(1 if res.status == 0 else 2, res.x[:-1], res.x[-1], res.mip_node_count,
+                                relative_gap(res.fun, res.mip_dual_bound))
+        if res.status != 0:
+            return SolverResult(-1)
+        return SolverResult(1, res.x[:-1], res.x[-1], res.nit, 0.0)
+
+
+class HighspyBackend(SolverBackend):
+    """
+    Solves the matrix form of the problem in-process by the HiGHS solver, via its own python interface (highspy).
+    The model is kept between consecutive solves of the same problem: when only the budget changes (c.f. a budget
+    sweep), only the bound of the budget row is modified, and the solver is warm-started - from the previous basis
+    for linear programs, and from the previous selection (adjusted to the new budget) for integer programs.
+    """
+    name = "highs"
+
+    def __init__(self, warm_start: bool = True):
+        """
+        :param warm_start: False --> every solve starts from scratch (the model is still reused)
+        """
+        import highspy
+        self.highspy = highspy
+        self.warm_start = warm_start
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        self.matrix_form = None  # the matrix form which is currently loaded to self.highs
+        self.previous_x = None   # the person variable values of the previous solution
+        # model statuses of a solve that was stopped before proving optimality
+        self.limit_status_lst = [highspy.HighsModelStatus.kTimeLimit, highspy.HighsModelStatus.kIterationLimit,
+                                 highspy.HighsModelStatus.kSolutionLimit]
+
+    def load_matrix_form(self, mf: MatrixForm):
+        highspy = self.highspy
+        A_ub = sp.csc_matrix(mf.A_ub)
+        lp = highspy.HighsLp()
+        lp.num_col_ = A_ub.shape[1]
+        lp.num_row_ = A_ub.shape[0]
+        lp.col_cost_ = mf.c
+        lp.col_lower_ = np.where(np.isinf(mf.lb), -highspy.kHighsInf, mf.lb)
+        lp.col_upper_ = np.where(np.isinf(mf.ub), highspy.kHighsInf, mf.ub)
+        lp.row_lower_ = np.full(A_ub.shape[0], -highspy.kHighsInf)
+        lp.row_upper_ = mf.b_ub.copy()
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = A_ub.indptr
+        lp.a_matrix_.index_ = A_ub.indices
+        lp.a_matrix_.value_ = A_ub.data
+        if mf.integrality.any():
+            lp.integrality_ = [highspy.HighsVarType.kInteger if integer else highspy.HighsVarType.kContinuous
+                               for integer in mf.integrality]
+        self.highs.passModel(lp)
+        self.matrix_form = mf
+        self.previous_x = None
+
+    def seed_solution(self, mf: MatrixForm):
+        """
+        Provides the integer program with a feasible starting solution: the previous selection, trimmed or extended
+        to the current budget. The variables are counts bounded by their upper bounds (1 per person, or the class
+        sizes with presolve), so units are removed from the columns of the lowest objective coefficients, or added
+        to the columns of the highest objective coefficients (up to their upper bounds), until the budget is met.
+        """
+        budget = int(round(mf.b_ub[mf.budget_row]))
+        capacity = np.floor(mf.ub[:-1])
+        x = np.minimum(np.round(self.previous_x), capacity)
+        order = np.argsort(mf.c[:-1], kind="stable")  # the highest objective coefficients first
+        excess = x.sum() - budget
+        if excess > 0:
+            removable = x[order[::-1]]
+            x[order[::-1]] -= np.clip(excess - (np.cumsum(removable) - removable), 0, removable)
+        elif excess < 0:
+            addable = (capacity - x)[order]
+            x[order] += np.clip(-excess - (np.cumsum(addable) - addable), 0, addable)
+        group_rows = np.ones(mf.A_ub.shape[0], dtype=bool)
+        group_rows[mf.budget_row] = False
+        z = (-mf.A_ub[group_rows][:, :-1].dot(x)).min() if group_rows.any() else 0.0
+        solution = self.highspy.HighsSolution()
+        solution.col_value = np.append(x, z).tolist()
+        self.highs.setSolution(solution)
+
+    def solve(self, problem, verbosity: int = 0) -> SolverResult:
+        highspy = self.highspy
+        mf = problem.get_matrix_form()
+        self.highs.setOptionValue("output_flag", verbosity > 1)
+        self.highs.setOptionValue("time_limit", highspy.kHighsInf if problem.time_limit is None
+                                  else float(problem.time_limit))
+        self.highs.setOptionValue("mip_rel_gap", 1e-4 if problem.mip_rel_gap is None else float(problem.mip_rel_gap))
+        if mf is not self.matrix_form and (mf.base is None or mf.base is not self.matrix_form):
+            self.load_matrix_form(mf)
+        else:
+            if mf is not self.matrix_form:
+                # the loaded problem, extended by additional constraints
+                new_rows = sp.csr_matrix(mf.A_ub[self.matrix_form.A_ub.shape[0]:])
+                self.highs.addRows(new_rows.shape[0], np.full(new_rows.shape[0], -highspy.kHighsInf),
+                                   mf.b_ub[self.matrix_form.A_ub.shape[0]:], new_rows.nnz,
+                                   new_rows.indptr[:-1], new_rows.indices, new_rows.data)
+                self.matrix_form = mf
+            # the same problem, possibly with a different budget
+            self.highs.changeRowBounds(mf.budget_row, -highspy.kHighsInf, mf.b_ub[mf.budget_row])
+            if not self.warm_start:
+                self.highs.clearSolver()
+            elif mf.integrality.any() and self.previous_x is not None:
+                self.seed_solution(mf)
+
+        self.highs.run()
+        model_status = self.highs.getModelStatus()
+        info = self.highs.getInfo()
+        if model_status == highspy.HighsModelStatus.kOptimal:
+            status = 1
+        elif mf.integrality.any() and model_status in self.limit_status_lst and info.primal_solution_status == 2:
+            status = 2  # stopped by a limit, with a feasible incumbent
+        else:
+            self.previous_x = None
+            return SolverResult(-1)
+        if mf.integrality.any():
+            iterations, gap = info.mip_node_count, relative_gap(info.objective_function_value, info.mip_dual_bound)
+        else:
+            iterations, gap = info.simplex_iteration_count, 0.0
+        values = np.array(self.highs.getSolution().col_value)
+        self.previous_x = values[:-1]
+        return SolverResult(status, values[:-1], values[-1], iterations, gap)
+
+
+def relative_gap(objective: float, bound: float) -> float:
+    """
+    :param objective: the (minimized) objective of a solution
+    :param bound: a lower bound on the optimal objective
+    :return: the gap between the two relative to the bound (c.f. SolverResult.gap), 0 if the bound is 0
+    """
+    return (objective - bound) / abs(bound) if bound != 0 else 0.0
+
+
+def highs_available() -> bool:
+    """
+    :return: True iff the installed scipy ships the HiGHS interface (scipy >= 1.9)
+    """
+    try:
+        from scipy.optimize import milp
+        return True
+    except ImportError:
+        return False
+
+
+def highspy_available() -> bool:
+    """
+    :return: True iff the HiGHS python interface (highspy) is installed
+    """
+    try:
+        import highspy
+        return True
+    except ImportError:
+        return False
+
+
+def make_solver_backend(name: str = "highs", path: str = "", warm_start: bool = True) -> SolverBackend:
+    """
+    :param name: "highs" - an in-process solver: highspy if installed (supports warm starts), otherwise scipy's
+                           HiGHS interface (falls back to "glpk" if the installed scipy doesn't provide it)
+                 "glpk" - an external glpsol executable
+    :param path: a path to the glpsol executable (only relevant for the "glpk" backend)
+    :param warm_start: True --> consecutive solves of the same problem are warm-started (if the backend supports it)
+    :return: a SolverBackend instance
+    """
+    allowed_backends = ["highs", "glpk"]
+    if name not in allowed_backends:
+        raise TypeError("For the solver backend the only acceptable values are {}. Given:{}".format(allowed_backends,
+                                                                                                     name))
+    if name == "highs" and highspy_available():
+        return HighspyBackend(warm_start=warm_start)
+    if name == "highs" and highs_available():
+        return HighsBackend()
+    return GlpkCmdBackend(path)
+
+
+def pulp_problem_to_matrix_form(problem: pl.LpProblem, variables: List[pl.LpVariable],
+                                budget_constraint_name: str) -> MatrixForm:
+    """
+    Converts a pulp problem to a matrix form. Only inequality constraints are supported.
+    :param problem: pulp LpProblem (either maximization or minimization)
+    :param variables: list of all the problem variables, determining the columns order of the matrix form
+    :param budget_constraint_name: the name of the constraint on the number of tests
+    :return: MatrixForm
+    """
+    var_idx_dict = {var.name: var_idx for var_idx, var in enumerate(variables)}
+    sense = -1.0 if problem.sense == pl.LpMaximize else 1.0
+    c = np.zeros(len(variables), dtype=np.float64)
+    for var, coefficient in problem.objective.items():
+        c[var_idx_dict[var.name]] = sense * coefficient
+
+    row_lst, col_lst, data_lst, b_lst = [], [], [], []
+    budget_row = -1
+    for row_idx, (constraint_name, constraint) in enumerate(problem.constraints.items()):
+        # pulp keeps "expression <= b" as "expression - b <= 0", and similarly for ">="
+        row_sign = -1.0 if constraint.sense == pl.LpConstraintGE else 1.0
+        for var, coefficient in constraint.items():
+            row_lst.append(row_idx)
+            col_lst.append(var_idx_dict[var.name])
+            data_lst.append(row_sign * coefficient)
+        b_lst.append(-row_sign * constraint.constant)
+        if constraint_name == budget_constraint_name:
+            budget_row = row_idx
+    A_ub = sp.csr_matrix((data_lst, (row_lst, col_lst)), shape=(len(b_lst), len(variables)))
+
+    lb = np.array([-np.inf if var.lowBound is None else var.lowBound for var in variables], dtype=np.float64)
+    ub = np.array([np.inf if var.upBound is None else var.upBound for var in variables], dtype=np.float64)
+    integrality = np.array([1 if var.cat == pl.LpInteger else 0 for var in variables], dtype=np.int8)
+    return MatrixForm(c, A_ub, np.array(b_lst, dtype=np.float64), lb, ub, integrality, budget_row)
+
+
+def matrix_form_to_pulp_problem(matrix_form: MatrixForm, name: str,
+                                budget_constraint_name: str) -> Tuple[pl.LpProblem, List[pl.LpVariable]]:
+    """
+    Converts a matrix form of the people selection problem to a pulp (maximization) problem.
+    :param matrix_form: MatrixForm whose variables are [x_0, ..., x_(|V|-1), z]
+    :param name: the name of the pulp problem
+    :param budget_constraint_name: the name to give to the constraint on the number of tests
+    :return: a 2-tuple: the pulp LpProblem, and the list of its variables (ordered as the matrix form columns)
+    """
+    mf = matrix_form
+    num_variables = len(mf.c)
+    problem = pl.LpProblem(name, sense=pl.LpMaximize)
+    variables = []
+    for var_idx in range(num_variables):
+        var_name = "z" if var_idx == num_variables - 1 else "x_{}".format(var_idx)
+        variables.append(pl.LpVariable(var_name,
+                                       lowBound=None if np.isinf(mf.lb[var_idx]) else mf.lb[var_idx],
+                                       upBound=None if np.isinf(mf.ub[var_idx]) else mf.ub[var_idx],
+                                       cat=pl.LpInteger if mf.integrality[var_idx] else pl.LpContinuous))
+    A_ub = sp.csr_matrix(mf.A_ub)
+    for row_idx in range(A_ub.shape[0]):
+        row_slice = slice(A_ub.indptr[row_idx], A_ub.indptr[row_idx + 1])
+        expression = pl.LpAffineExpression([(variables[var_idx], coefficient) for var_idx, coefficient
+                                            in zip(A_ub.indices[row_slice], A_ub.data[row_slice])])
+        constraint_name = budget_constraint_name if row_idx == mf.budget_row else "group_row_{}_coverage".format(row_idx)
+        problem += expression <= mf.b_ub[row_idx], constraint_name
+    problem += pl.LpAffineExpression([(variables[var_idx], -mf.c[var_idx]) for var_idx in np.flatnonzero(mf.c)])
+    return problem, variables
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from typing import Union
+
+
+def content_hash(*parts) -> str:
+    """
+    Hashes the contents of the given objects (not their identities), so that equal inputs yield equal hashes
+    across processes and sessions.
+    :param parts: numpy arrays, scipy sparse matrices, pandas dataframes, strings, numbers, None, and
+                  lists/tuples/dicts thereof
+    :return: a hexadecimal digest string
+    """
+    digest = hashlib.sha256()
+    update_hash(digest, parts)
+    return digest.hexdigest()
+
+
+def update_hash(digest, obj):
+    """
+    Feeds a single object (recursively) into a hashlib digest, c.f. content_hash
+    """
+    if isinstance(obj, np.ndarray) and obj.dtype == object:
+        # the bytes of an object array are pointers, hash the representations of the objects instead
+        digest.update("objects{}".format(obj.shape).encode())
+        digest.update("\x00".join(map(repr, obj.ravel().tolist())).encode())
+    elif isinstance(obj, np.ndarray):
+        digest.update("ndarray{}{}".format(obj.dtype.str, obj.shape).encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, pd.DataFrame):
+        digest.update("dataframe{}".format(obj.shape).encode())
+        update_hash(digest, [str(column) for column in obj.columns])
+        for col_idx in range(obj.shape[1]):
+            update_hash(digest, obj.iloc[:, col_idx].to_numpy())
+    elif sp.issparse(obj):
+        obj = sp.csr_matrix(obj)
+        obj.sort_indices()
+        digest.update("sparse{}".format(obj.shape).encode())
+        for arr in (obj.indptr, obj.indices, obj.data):
+            update_hash(digest, arr)
+    elif isinstance(obj, (list, tuple)):
+        digest.update("{}{}".format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            update_hash(digest, item)
+    elif isinstance(obj, dict):
+        digest.update("dict{}".format(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            update_hash(digest, key)
+            update_hash(digest, obj[key])
+    else:
+        digest.update("{}:{!r};".format(type(obj).__name__, obj).encode())
+
+
+class SolutionCache:
+    """
+    A disk-backed cache of solutions (any picklable objects), one file per key. When the total size of the cache
+    exceeds max_size bytes, the least recently used entries are evicted (a hit refreshes the modification time of
+    its file, which serves as the time of its last use).
+    """
+    def __init__(self, directory: str, max_size: int = 256 * 2 ** 20):
+        """
+        :param directory: the directory of the cache files (created upon the first store)
+        :param max_size: the maximal total size (in bytes) of the cache files
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key: str) -> Union[object, None]:
+        """
+        :param key: a key string (e.g. a content_hash)
+        :return: the stored object, or None if the key is missing (or its entry is unreadable)
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # a corrupt or incompatible entry is treated as missing
+            self.remove(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value):
+        """
+        Stores an object under a key (replacing any previous entry atomically), then evicts the least recently
+        used entries if the cache grew beyond its maximal size.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def remove(self, key: str):
+        try:
+            os.remove(self.entry_path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the total size of the cache is at most self.max_size
+        """
+        entry_lst = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    entry_lst.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entry_lst)
+        for _, size, path in sorted(entry_lst):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """
+        Removes all the entries of the cache
+        """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.directory, name))
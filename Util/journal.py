@@ -0,0 +1,95 @@
+import os
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Tuple, Union
+from MyDate import MyDate, days_to_mydate
+
+
+class TestJournal:
+    """
+    An append-only log of the COVID19 tests of the people (a (worker ID, test day) event per tested person, the days
+    being counted since the epoch as in MyDate.days), kept in an SQLite database. The date of the last test of each
+    person is computed from the log, so recording the checklist of a day costs a single insertion per tested person -
+    instead of a rewrite of the whole main spreadsheet. A main spreadsheet whose writing is deferred is recorded as the
+    (latest written) main spreadsheet it is based on, which is brought up to date by the tests logged since its date
+    (c.f. latest_test_dates).
+    """
+    def __init__(self, path: str):
+        """
+        :param path: the path of the database file (created upon the first use)
+        """
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        :return: a new connection to the database (a connection per operation, as the app serves requests from
+                 several threads)
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS test_event (worker_id TEXT NOT NULL, test_day INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS test_event_by_day ON test_event (test_day, worker_id);
+            CREATE TABLE IF NOT EXISTS checklist (test_day INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS deferred_main (main_day INTEGER PRIMARY KEY, base_filename TEXT NOT NULL);
+        """)
+        return connection
+
+    def record_checklists(self, checklist_lst: List[Tuple[MyDate, List[str], str]]):
+        """
+        Logs the tests of the people of several checklists, in a single transaction. The events of a checklist that
+        was already logged (for the same date) are replaced, as the checklist might have changed since.
+        :param checklist_lst: list of (test_date, worker_id_lst, fingerprint) of the checklists:
+                              the date of the checklist, the worker IDs of the people that were tested, and the
+                              version of the checklist (c.f. checklist_fingerprint)
+        """
+        with closing(self.connect()) as connection, connection:
+            for test_date, worker_id_lst, fingerprint in checklist_lst:
+                test_day = test_date.days
+                connection.execute("DELETE FROM test_event WHERE test_day = ?", (test_day,))
+                connection.executemany("INSERT INTO test_event (worker_id, test_day) VALUES (?, ?)",
+                                       ((worker_id, test_day) for worker_id in worker_id_lst))
+                connection.execute("INSERT OR REPLACE INTO checklist (test_day, fingerprint) VALUES (?, ?)",
+                                   (test_day, fingerprint))
+
+    def checklist_fingerprint(self, test_date: MyDate) -> Union[str, None]:
+        """
+        :return: the fingerprint of the logged checklist of test_date, or None if no checklist of this date was logged
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT fingerprint FROM checklist WHERE test_day = ?",
+                                     (test_date.days,)).fetchone()
+        return None if row is None else row[0]
+
+    def latest_test_dates(self, first_date: MyDate, end_date: MyDate) -> Dict[str, str]:
+        """
+        :return: a dictionary from the worker ID of each person that was tested within [first_date, end_date) to the
+                 date string of the last test of this person
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT worker_id, MAX(test_day) FROM test_event "
+                                      "WHERE test_day >= ? AND test_day < ? GROUP BY worker_id",
+                                      (first_date.days, end_date.days)).fetchall()
+        return {worker_id: days_to_mydate(test_day).strdate for worker_id, test_day in rows}
+
+    def defer_main(self, main_date: MyDate, base_path: str):
+        """
+        Records that the main spreadsheet of main_date consists of the main spreadsheet base_path (of an earlier date),
+        updated by the tests logged since the date of base_path.
+        """
+        with closing(self.connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO deferred_main (main_day, base_filename) VALUES (?, ?)",
+                               (main_date.days, os.path.basename(base_path)))
+
+    def deferred_main_base(self, main_date: MyDate) -> Union[str, None]:
+        """
+        :return: the path of the main spreadsheet on which the (deferred) main spreadsheet of main_date is based,
+                 or None if the main spreadsheet of main_date wasn't deferred (or its base no longer exists)
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT base_filename FROM deferred_main WHERE main_day = ?",
+                                     (main_date.days,)).fetchone()
+        if row is None:
+            return None
+        base_path = os.path.join(os.path.dirname(self.path), row[0])
+        return base_path if os.path.exists(base_path) else None
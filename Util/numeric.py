@@ -22,19 +22,18 @@ def modified_sigmoid(x: float, coefficient: float, shift: float) -> float:
     return 1/(1+math.exp(-coefficient*(x-shift)))
 
 
-def modified_sigmoid_vector(x_list: Iterable[Union[float, int]],
+def modified_sigmoid_vector(x_list: Union[Iterable[Union[float, int]], np.ndarray],
                             coefficient: Union[float, int],
-                            shift: Union[float, int]) -> List[float]:
+                            shift: Union[float, int]) -> np.ndarray:
     """
-    returns a modified (parameterized) sigmoid function values list
+    returns a modified (parameterized) sigmoid function values array
     corresponding to the argument list "x_list
-    :param x_list: list of arguments (floats)
+    :param x_list: list (or a numpy array) of arguments (floats)
     :param shift: parameter determining the shift of the sigmoid function
                   (i.e. the value at which the sigmoid crosses the value 0.5)
     :param coefficient: a scaling factor determining the slope of the sigmoid
-    :return: list of sigmoid function values corresponding to the x_list argument values.
+    :return: numpy array of sigmoid function values corresponding to the x_list argument values.
     """
-    a = []
-    for x in x_list:
-        a.append(modified_sigmoid(coefficient, shift))
-    return a
\ No newline at end of file
+    x_arr = np.asarray(x_list, dtype=np.float64)
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-coefficient * (x_arr - shift)))
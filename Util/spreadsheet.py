@@ -1,13 +1,19 @@
-from shutil import copyfile
-from pyexcel_ods import save_data as save_ods_data
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import numpy as np
 import os
 import pandas as pd
+import re
 from MyDate import MyDate
 from Institution import Institution
-from typing import Tuple, List, Union
+from Util.cache import content_hash
+from Util.journal import TestJournal
+from typing import Tuple, List, Dict, Union
 import ezodf
+import openpyxl
+import zipfile
+from lxml import etree
+from xml.sax.saxutils import escape as xml_escape, quoteattr
 import xlsxwriter
 
 
@@ -69,18 +75,56 @@ def stringify_cell(cell_value):
     return str_value
 
 
+def stringify_column(column: pd.Series) -> pd.Series:
+    """
+    A vectorized stringify_cell of a column of strings: the numeric strings are cast to integer strings, the rest
+    of the strings are left as they are.
+    :param column: pandas Series of strings
+    :return: pandas Series of strings
+    """
+    numeric = pd.to_numeric(column, errors="coerce")
+    convertible = np.isfinite(numeric) & (numeric.abs() < 2 ** 63)
+    stringified = column.astype(object)
+    stringified[convertible] = numeric[convertible].astype(np.int64).astype(str)
+    unparsed = numeric.isna() & column.notna()
+    if unparsed.any():  # strings that pandas doesn't parse as numbers, which python might (e.g. "1_000")
+        stringified[unparsed] = column[unparsed].map(stringify_cell)
+    return stringified
+
+
+def compact_integer_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts all the columns of a dataframe to integers at once, of the most compact type that holds all of them
+    (typically int8 or uint8 for group memberships and risk factor scores)
+    :param df:
+    :return: a new dataframe, whose columns all share the same integer type
+    """
+    values = df.astype(np.int64).to_numpy()
+    if values.size == 0:
+        return pd.DataFrame(values.astype(np.int8), index=df.index, columns=df.columns)
+    dtype = np.result_type(np.min_scalar_type(values.min()), np.min_scalar_type(values.max()))
+    return pd.DataFrame(values.astype(dtype), index=df.index, columns=df.columns)
+
+
+def set_dataframe_column_types(df: pd.DataFrame, num_text_columns: int) -> pd.DataFrame:
+    """
+    Sets the first num_text_columns columns to be strings (the first 2 of them - the ID columns - are stringified
+    as numbers, c.f. stringify_column), and the rest of the columns to be compact integers
+    (c.f. compact_integer_dataframe)
+    """
+    text_df = df.iloc[:, :num_text_columns].astype(str)
+    for column in text_df.columns[:2]:
+        text_df[column] = stringify_column(text_df[column])
+    return pd.concat([text_df, compact_integer_dataframe(df.iloc[:, num_text_columns:])], axis=1)
+
+
 def set_organization_dataframe_column_types(organization_df: pd.DataFrame) -> pd.DataFrame:
     """
     Sets the first 4 columns to be strings, and the rest of the columns to be integers
     :param organization_df:
     :return:
     """
-    type_lst = [str] * 4 + [int] * (len(organization_df.columns)-4)
-    convert_dict = {colname: typename for colname, typename in zip(organization_df.columns, type_lst)}
-    organization_df = organization_df.astype(convert_dict)
-    organization_df[organization_df.columns[0]] = organization_df[organization_df.columns[0]].apply(stringify_cell)
-    organization_df[organization_df.columns[1]] = organization_df[organization_df.columns[1]].apply(stringify_cell)
-    return organization_df
+    return set_dataframe_column_types(organization_df, num_text_columns=4)
 
 
 def set_risk_dataframe_column_types(risk_df: pd.DataFrame) -> pd.DataFrame:
@@ -89,13 +133,7 @@ def set_risk_dataframe_column_types(risk_df: pd.DataFrame) -> pd.DataFrame:
     :param risk_df:
     :return:
     """
-    # using dictionary to convert specific columns
-    type_lst = [str] * 5 + [int] * (len(risk_df.columns) - 5)
-    convert_dict = {colname: typename for colname, typename in zip(risk_df.columns, type_lst)}
-    risk_df = risk_df.astype(convert_dict)
-    risk_df[risk_df.columns[0]] = risk_df[risk_df.columns[0]].apply(stringify_cell)
-    risk_df[risk_df.columns[1]] = risk_df[risk_df.columns[1]].apply(stringify_cell)
-    return risk_df
+    return set_dataframe_column_types(risk_df, num_text_columns=5)
 
 
 def set_checklist_dataframe_column_types(checklist_df: pd.DataFrame) -> pd.DataFrame:
@@ -104,19 +142,18 @@ def set_checklist_dataframe_column_types(checklist_df: pd.DataFrame) -> pd.DataF
     :param checklist_df:
     :return:
     """
+    return set_dataframe_column_types(checklist_df, num_text_columns=len(checklist_df.columns))
 
-    convert_dict = {colname: str for colname in checklist_df.columns}
-    checklist_df = checklist_df.astype(convert_dict)
-    checklist_df[checklist_df.columns[0]] = checklist_df[checklist_df.columns[0]].apply(stringify_cell)
-    checklist_df[checklist_df.columns[1]] = checklist_df[checklist_df.columns[1]].apply(stringify_cell)
-    return checklist_df
 
-
-def read_main_spreadsheet(spreadsheet_path: str) -> Tuple[Union[pd.DataFrame, None], Union[pd.DataFrame, None], str]:
+def read_main_spreadsheet(spreadsheet_path: str,
+                          use_sidecar: bool = True) -> Tuple[Union[pd.DataFrame, None], Union[pd.DataFrame, None], str]:
     """
     Reads an "ods" or an "xlsx" file and returns 2 pandas-dataframes with the corresponding sheets in them.
     Replaces empty values with zeroes.
     :param spreadsheet_path:
+    :param use_sidecar: True --> the dataframes are restored from the binary sidecar file of the spreadsheet if it is
+                        up to date (c.f. read_main_spreadsheet_sidecar), otherwise the spreadsheet is parsed and the
+                        sidecar is (re)written.
     :return:
     """
     path_valid, path_err_msg = validate_main_spreadsheet(spreadsheet_path)
@@ -126,12 +163,14 @@ def read_main_spreadsheet(spreadsheet_path: str) -> Tuple[Union[pd.DataFrame, No
         err_msg = "This type of spreadsheet cannot be handled at this time. Only ods and xlsx are supported."
         print(err_msg)
         return None, None, err_msg
-    elif spreadsheet_path[-3:] == "ods":
-        organization_df = read_ods(filename=spreadsheet_path, sheet=0)
-        risk_df = read_ods(filename=spreadsheet_path, sheet=1)
+    if use_sidecar:
+        organization_df, risk_df = read_main_spreadsheet_sidecar(spreadsheet_path)
+        if organization_df is not None:
+            return organization_df, risk_df, ""
+    if spreadsheet_path[-3:] == "ods":
+        organization_df, risk_df = read_ods_sheets(spreadsheet_path, num_sheets=2)
     elif spreadsheet_path[-4:] == "xlsx":
-        organization_df = read_excel(spreadsheet_path, skip_blank_lines=True, sheet=0)
-        risk_df = read_excel(spreadsheet_path, skip_blank_lines=True, sheet=1)
+        organization_df, risk_df = read_xlsx_sheets(spreadsheet_path, num_sheets=2)
     else:
         err_msg = "This type of spreadsheet cannot be handled at this time. Only ods and xlsx are supported."
         print(err_msg)
@@ -149,9 +188,125 @@ def read_main_spreadsheet(spreadsheet_path: str) -> Tuple[Union[pd.DataFrame, No
                   "spreadsheet have differences in the name lists.".format(spreadsheet_path)
         print(err_msg)
         return None, None, err_msg
+    if use_sidecar:
+        write_main_spreadsheet_sidecar(spreadsheet_path, organization_df, risk_df)
     return organization_df, risk_df, ""
 
 
+SIDECAR_FORMAT_VERSION = 3
+
+
+def main_spreadsheet_sidecar_path(spreadsheet_path: str) -> str:
+    """
+    :return: the path of the binary sidecar file of a main spreadsheet (next to the spreadsheet itself)
+    """
+    return spreadsheet_path + ".npz"
+
+
+def spreadsheet_file_fingerprint(spreadsheet_path: str) -> np.ndarray:
+    """
+    :return: 1D array of the modification time (ns), the size and the sha256 hash of the file (4 x 64 bits)
+    """
+    stat = os.stat(spreadsheet_path)
+    digest = hashlib.sha256()
+    with open(spreadsheet_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return np.concatenate(([stat.st_mtime_ns, stat.st_size],
+                           np.frombuffer(digest.digest(), dtype=np.int64))).astype(np.int64)
+
+
+def read_main_spreadsheet_sidecar(spreadsheet_path: str) -> Tuple[Union[pd.DataFrame, None], Union[pd.DataFrame, None]]:
+    """
+    Restores the dataframes of a main spreadsheet from its sidecar file (c.f. write_main_spreadsheet_sidecar),
+    provided that the spreadsheet didn't change since the sidecar was written - i.e. it has the same modification
+    time, size and hash.
+    :return: organization_df, risk_df - or None, None if there is no valid sidecar
+    """
+    sidecar_path = main_spreadsheet_sidecar_path(spreadsheet_path)
+    if not os.path.exists(sidecar_path):
+        return None, None
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as sidecar:
+            if not main_spreadsheet_sidecar_is_valid(sidecar, spreadsheet_path):
+                return None, None
+            dataframes = []
+            for sheet in ("organization", "risk"):
+                column_names = sidecar[sheet + "_columns"].tolist()
+                text_columns = sidecar[sheet + "_text"]
+                numeric_columns = sidecar[sheet + "_numeric"]
+                df = pd.DataFrame({column_name: text_columns[col_idx].astype(object)
+                                   for col_idx, column_name in enumerate(column_names[:len(text_columns)])})
+                numeric_df = pd.DataFrame(numeric_columns, columns=column_names[len(text_columns):])
+                dataframes.append(pd.concat([df, numeric_df], axis=1))
+    except Exception:
+        # an unreadable sidecar is simply ignored (it is rewritten after the spreadsheet is parsed)
+        return None, None
+    return dataframes[0], dataframes[1]
+
+
+def main_spreadsheet_sidecar_is_valid(sidecar, spreadsheet_path: str) -> bool:
+    """
+    :param sidecar: the loaded (npz) sidecar of the spreadsheet
+    :return: True if the sidecar is of the current format, and the spreadsheet didn't change since it was written
+    """
+    return int(sidecar["format_version"]) == SIDECAR_FORMAT_VERSION and \
+        np.array_equal(sidecar["fingerprint"], spreadsheet_file_fingerprint(spreadsheet_path))
+
+
+def read_main_spreadsheet_sheet_digests(spreadsheet_path: str) -> Union[List[str], None]:
+    """
+    :return: the digests of the sheets of the spreadsheet, as recorded in its sidecar when the spreadsheet was written
+             (c.f. produce_weighted_risk_sheet), or None if there is no valid sidecar or no digests were recorded
+    """
+    sidecar_path = main_spreadsheet_sidecar_path(spreadsheet_path)
+    if not os.path.exists(sidecar_path):
+        return None
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as sidecar:
+            if not main_spreadsheet_sidecar_is_valid(sidecar, spreadsheet_path):
+                return None
+            sheet_digests = sidecar["sheet_digests"].tolist()
+    except Exception:
+        return None
+    return sheet_digests if len(sheet_digests) > 0 else None
+
+
+def write_main_spreadsheet_sidecar(spreadsheet_path: str, organization_df: pd.DataFrame, risk_df: pd.DataFrame,
+                                   sheet_digests: List[str] = None) -> bool:
+    """
+    Writes the parsed dataframes of a main spreadsheet into a binary (uncompressed npz) sidecar file, along with
+    the fingerprint of the spreadsheet file. Per sheet, the string columns (the person details, and the date of the
+    last test in the risk sheet) are kept as a 2D unicode array, and the integer columns (groups or risk factors) as
+    a 2D integer array of their compact type, so restoring them involves no parsing at all. Only the dataframes are
+    kept: the arrays of an Institution (incidence, test days, weights) are built from them on every load, as they
+    also depend on the current date and on the risk profile.
+    :param sheet_digests: the content hashes of all the sheets of the spreadsheet, if known (c.f.
+                          read_main_spreadsheet_sheet_digests)
+    :return: True if the sidecar was written
+    """
+    num_text_columns_dict = {"organization": 4, "risk": 5}
+    if not all(isinstance(column, str) for df in (organization_df, risk_df) for column in df.columns):
+        return False
+    arrays = dict(format_version=np.array(SIDECAR_FORMAT_VERSION),
+                  fingerprint=spreadsheet_file_fingerprint(spreadsheet_path),
+                  sheet_digests=np.array(sheet_digests or [], dtype=str))
+    for sheet, df in (("organization", organization_df), ("risk", risk_df)):
+        num_text_columns = num_text_columns_dict[sheet]
+        arrays[sheet + "_columns"] = np.array(list(df.columns), dtype=str)
+        arrays[sheet + "_text"] = np.array([df[column].to_numpy(dtype=str) for column in df.columns[:num_text_columns]],
+                                           dtype=str).reshape(num_text_columns, len(df))
+        arrays[sheet + "_numeric"] = df.iloc[:, num_text_columns:].to_numpy()
+    sidecar_path = main_spreadsheet_sidecar_path(spreadsheet_path)
+    try:
+        with open(sidecar_path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+    except OSError:
+        return False
+    return True
+
+
 def read_excel(filename: str, skip_blank_lines: bool, sheet: int, usecols=None) -> pd.DataFrame:
     """
     reads an excel file and returns a pandas dataframe
@@ -164,13 +319,7 @@ def read_excel(filename: str, skip_blank_lines: bool, sheet: int, usecols=None)
     :return: a dataframe, obtained from a single sheet of the excel filename.
     """
     df = pd.read_excel(filename, skip_blank_lines=skip_blank_lines, sheet_name=sheet, usecols=usecols)
-    df.dropna(axis=0, how='all', thresh=None, subset=None, inplace=True)
-    df = df.fillna(0)
-    df.dropna(axis=1, how='all', thresh=None, subset=None, inplace=True)
-
-    # replace field that's entirely space (or empty) with NaN
-    df = df.replace(r'^\s*$', 0.0, regex=True)
-    return df
+    return clean_dataframe(df)
 
 
 def read_ods(filename, sheet=0, header=0, usecols=None) -> pd.DataFrame:
@@ -191,12 +340,188 @@ def read_ods(filename, sheet=0, header=0, usecols=None) -> pd.DataFrame:
             if col_idx in usecols:
                 dict_for_df[col[header].value] = [x.value for x in col[header + 1:]]
         df = pd.DataFrame(dict_for_df)
-    df = df.replace(to_replace='None', value=np.nan)
+    return clean_dataframe(replace_strings(df, 'None', np.nan))
+
+
+def read_xlsx_sheets(filename: str, num_sheets: int) -> List[pd.DataFrame]:
+    """
+    Reads the first sheets of an xlsx file in a single pass - the workbook is opened once, in the streaming
+    (read-only) mode of openpyxl. Each sheet is cleaned as in read_excel.
+    :param filename: a path to the xlsx file.
+    :param num_sheets: number of sheets to read (from the first one)
+    :return: list of dataframes, one per sheet
+    """
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True, keep_links=False)
+    try:
+        df_lst = [rows_to_dataframe(worksheet.iter_rows(values_only=True))
+                  for worksheet in workbook.worksheets[:num_sheets]]
+    finally:
+        workbook.close()
+    df_lst = [clean_dataframe(df) for df in df_lst]
+    return df_lst
+
+
+def read_ods_sheets(filename: str, num_sheets: int) -> List[pd.DataFrame]:
+    """
+    Reads the first sheets of an ods file in a single pass - the content XML is streamed (iterparse) rather than
+    loaded as a whole document tree, and each row is discarded as soon as its values are taken. Repeated rows and
+    cells are expanded, unless they are empty and trailing. Each sheet is cleaned as in read_ods.
+    :param filename: a path to the ods file.
+    :param num_sheets: number of sheets to read (from the first one)
+    :return: list of dataframes, one per sheet
+    """
+    table_tag = "{{{}}}table".format(ODS_NAMESPACES["table"])
+    row_tag = "{{{}}}table-row".format(ODS_NAMESPACES["table"])
+    df_lst = []
+    with zipfile.ZipFile(filename) as ods_zip, ods_zip.open("content.xml") as content:
+        row_lst = []
+        num_pending_empty_rows = 0  # repeated empty rows, which are only kept if a non-empty row follows them
+        for event, element in etree.iterparse(content, events=("end",), tag=(row_tag, table_tag)):
+            if element.tag == row_tag:
+                values = ods_row_values(element)
+                num_repeated = int(element.get("{{{}}}number-rows-repeated".format(ODS_NAMESPACES["table"]), 1))
+                if len(values) == 0:
+                    num_pending_empty_rows += num_repeated
+                else:
+                    row_lst.extend([()] * num_pending_empty_rows)
+                    row_lst.extend([values] * num_repeated)
+                    num_pending_empty_rows = 0
+                element.clear()
+                while element.getprevious() is not None:  # drop the (cleared) rows read so far
+                    del element.getparent()[0]
+            else:
+                df_lst.append(rows_to_dataframe(iter(row_lst)))
+                row_lst = []
+                num_pending_empty_rows = 0
+                element.clear()
+                if len(df_lst) == num_sheets:
+                    break
+    df_lst = [clean_dataframe(replace_strings(df, 'None', np.nan)) for df in df_lst]
+    return df_lst
+
+
+ODS_NAMESPACES = {"table": "urn:oasis:names:tc:opendocument:xmlns:table:1.0",
+                  "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+                  "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0"}
+
+
+def ods_row_values(row_element) -> tuple:
+    """
+    :param row_element: a table:table-row element of the ods content XML
+    :return: tuple of the cell values of the row, without the trailing empty cells (numbers as floats, dates and
+             strings as strings, empty cells as None - as ezodf reports them)
+    """
+    table_ns, office_ns = ODS_NAMESPACES["table"], ODS_NAMESPACES["office"]
+    values = []
+    num_pending_empty_cells = 0
+    for cell in row_element:
+        num_repeated = int(cell.get("{{{}}}number-columns-repeated".format(table_ns), 1))
+        value_type = cell.get("{{{}}}value-type".format(office_ns))
+        if value_type is None:
+            num_pending_empty_cells += num_repeated
+            continue
+        if value_type in ("float", "percentage", "currency"):
+            value = float(cell.get("{{{}}}value".format(office_ns)))
+        elif value_type == "date":
+            value = cell.get("{{{}}}date-value".format(office_ns))
+        elif value_type == "time":
+            value = cell.get("{{{}}}time-value".format(office_ns))
+        elif value_type == "boolean":
+            value = cell.get("{{{}}}boolean-value".format(office_ns)) == "true"
+        else:
+            value = ods_cell_text(cell)
+        values.extend([None] * num_pending_empty_cells)
+        values.extend([value] * num_repeated)
+        num_pending_empty_cells = 0
+    return tuple(values)
+
+
+def ods_cell_text(cell_element) -> str:
+    """
+    :return: the text of an ods cell - its paragraphs joined by newlines, with the encoded spaces and tabs expanded
+    """
+    text_ns = ODS_NAMESPACES["text"]
+    paragraph_lst = []
+    for paragraph in cell_element.iter("{{{}}}p".format(text_ns)):
+        part_lst = [paragraph.text or ""]
+        for child in paragraph.iter():
+            if child is paragraph:
+                continue
+            if child.tag == "{{{}}}s".format(text_ns):
+                part_lst.append(" " * int(child.get("{{{}}}c".format(text_ns), 1)))
+            elif child.tag == "{{{}}}tab".format(text_ns):
+                part_lst.append("\t")
+            elif child.tag == "{{{}}}line-break".format(text_ns):
+                part_lst.append("\n")
+            else:
+                part_lst.append(child.text or "")
+            part_lst.append(child.tail or "")
+        paragraph_lst.append("".join(part_lst))
+    return "\n".join(paragraph_lst)
+
+
+def rows_to_dataframe(row_iterator) -> pd.DataFrame:
+    """
+    Builds a dataframe of the rows of a sheet, the first of which is the header. Trailing empty cells are dropped,
+    unnamed columns are named "Unnamed: <index>" and repeated names get a ".<k>" suffix (as in pandas.read_excel).
+    :param row_iterator: an iterator of tuples of cell values (None for empty cells)
+    :return: a dataframe with the (uncleaned) values of the sheet
+    """
+    header = list(next(row_iterator, ()))
+    row_lst = list(row_iterator)
+    num_columns = max([len(header)] + [len(row) for row in row_lst])
+    while num_columns > 0 and header[num_columns - 1:num_columns] in ([], [None]) and \
+            all(len(row) < num_columns or row[num_columns - 1] is None for row in row_lst):
+        num_columns -= 1
+    header = header[:num_columns] + [None] * (num_columns - len(header))
+    column_lst = []
+    name_count_dict = {}
+    for col_idx, name in enumerate(header):
+        name = "Unnamed: {}".format(col_idx) if name is None else name
+        if name in name_count_dict:
+            name_count_dict[name] += 1
+            name = "{}.{}".format(name, name_count_dict[name])
+        else:
+            name_count_dict[name] = 0
+        column_lst.append(name)
+    padding = (None,) * num_columns
+    data = [tuple(row[:num_columns]) + padding[len(row):] for row in row_lst]
+    return pd.DataFrame.from_records(data, columns=column_lst, coerce_float=False) if len(data) > 0 \
+        else pd.DataFrame(columns=column_lst)
+
+
+def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drops the empty rows and replaces the empty values (and whitespace-only strings) with zeroes
+    """
     df.dropna(axis=0, how='all', thresh=None, subset=None, inplace=True)
     df = df.fillna(0)
     df.dropna(axis=1, how='all', thresh=None, subset=None, inplace=True)
-    # replace field that's entirely space (or empty) with NaN
-    df = df.replace(r'^\s*$', 0.0, regex=True)
+    # replace field that's entirely space (or empty) with zero
+    return replace_strings(df, r'\s*$', 0.0, regex=True)
+
+
+def replace_strings(df: pd.DataFrame, pattern: str, value, regex: bool = False) -> pd.DataFrame:
+    """
+    Replaces the string cells that match a pattern. Only the object columns are searched, as the rest can't hold
+    strings, and each of them is matched at once (through the pandas string methods).
+    :param df:
+    :param pattern: the string to replace, or a regular expression which must match at the beginning of the cell
+    :param value: the replacing value
+    :param regex: True --> pattern is a regular expression, False --> pattern is a plain string
+    :return: the dataframe (modified in place)
+    """
+    for column in df.columns[(df.dtypes == object).to_numpy()]:
+        if regex:
+            try:
+                matched = df[column].str.match(pattern)
+            except AttributeError:  # no strings at all in this column
+                continue
+        else:
+            matched = df[column] == pattern
+        matched = matched.fillna(False).astype(bool)
+        if matched.any():
+            df[column] = df[column].mask(matched, value)
     return df
 
 
@@ -205,6 +530,8 @@ def write_new_spreadsheet_to_file(dataframes: List[pd.DataFrame], sheet_names: L
     """
     Writes a 2-sheet spreadsheet to a file. The type of the spreadsheet is
     determined by the las characters in path_to_new_file.
+    The rows are streamed to the file in chunks (c.f. dataframe_row_chunks), so the whole spreadsheet is never
+    held in memory as cell objects.
     :param dataframes: list of pandas dataframes tobe written to the sheets in the spreadsheet file.
     :param sheet_names: list of string, which will determine the sheet names of in the spreadsheet file.
     :param path_to_new_file: the full path to a spreadsheet file to be created.
@@ -212,33 +539,12 @@ def write_new_spreadsheet_to_file(dataframes: List[pd.DataFrame], sheet_names: L
     :return: a 2-tuple: (True <---> succeeded, message)
     """
     if path_to_new_file[-4:] == "xlsx":
-        writer = pd.ExcelWriter(path_to_new_file, engine='xlsxwriter')
-        for df, sheet_name in zip(dataframes, sheet_names):
-            df.to_excel(excel_writer=writer, sheet_name=sheet_name, header=True, index=False)
-            if wide_columns:
-                for column in df.columns:
-                    column_length = max(df[column].astype(str).map(len).max(), len(column))
-                    col_idx = df.columns.get_loc(column)
-                    writer.sheets[sheet_name].set_column(col_idx, col_idx, column_length)
-        writer.save()
-        writer.close()
+        write_xlsx_stream(dataframes, sheet_names, path_to_new_file, wide_columns)
         msg = "Created the excel file {}".format(path_to_new_file)
         print(msg)
         return True, msg
     elif path_to_new_file[-3:] == "ods":
-        dict_of_sheets = OrderedDict()
-        for df, sheet_name in zip(dataframes, sheet_names):
-            # Initialize data to be written as an empty list, as pyods needs a list to write
-            # Write the columns first to be the first entries
-            current_sheet_row_wise = [list(df.columns)]
-            # loop through data frame (row-wise) and update the data list
-            for index, row in df.iterrows():
-                current_sheet_row_wise.append(list(row.values))
-            # Populate dict() with the sheet data
-            dict_of_sheets.update({sheet_name: current_sheet_row_wise})
-
-        # Finally call save_data() from pyods to store the ods file
-        save_ods_data(path_to_new_file, dict_of_sheets)
+        write_ods_stream(dataframes, sheet_names, path_to_new_file)
         msg = "Created the ODS file {}".format(path_to_new_file)
         print(msg)
         return True, msg
@@ -248,6 +554,130 @@ def write_new_spreadsheet_to_file(dataframes: List[pd.DataFrame], sheet_names: L
         return False, msg
 
 
+ROW_CHUNK_SIZE = 4096      # rows converted to python values at once, c.f. dataframe_row_chunks
+WIDTH_SAMPLE_SIZE = 1000   # rows measured per column of a general type, c.f. estimate_column_width
+
+
+def dataframe_row_chunks(df: pd.DataFrame, chunk_size: int = ROW_CHUNK_SIZE):
+    """
+    Converts the rows of a dataframe to tuples of python values, chunk after chunk (column by column within each
+    chunk, which is much faster than iterrows). Missing values become None.
+    :return: a generator of lists of row tuples
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        column_lst = []
+        for col_idx in range(chunk.shape[1]):
+            column = chunk.iloc[:, col_idx]
+            value_lst = column.tolist()
+            if column.hasnans:
+                value_lst = [None if missing else value for value, missing in zip(value_lst, column.isna().tolist())]
+            column_lst.append(value_lst)
+        yield list(zip(*column_lst))
+
+
+def estimate_column_width(column: pd.Series, column_name) -> int:
+    """
+    The width (in characters) of a spreadsheet column - the length of its name or of its longest value.
+    The longest integer is one of the extreme values, the lengths of strings are measured at once by the pandas
+    string methods, and the values of other types are measured on a sample of the rows.
+    :return: integer
+    """
+    width = len(str(column_name))
+    if len(column) == 0:
+        return width
+    if column.dtype.kind in "iub":
+        return max(width, len(str(column.min())), len(str(column.max())))
+    if column.dtype == object:
+        try:
+            lengths = column.str.len()  # NaN for the values that aren't strings
+            if lengths.notna().all():
+                return max(width, int(lengths.max()))
+        except AttributeError:  # no strings at all
+            pass
+    if len(column) > WIDTH_SAMPLE_SIZE:
+        column = column.iloc[np.linspace(0, len(column) - 1, WIDTH_SAMPLE_SIZE).astype(np.int64)]
+    return max(width, max(len(str(value)) for value in column.tolist()))
+
+
+def write_xlsx_stream(dataframes: List[pd.DataFrame], sheet_names: List[str], path_to_new_file: str,
+                      wide_columns: bool = True):
+    """
+    Writes the dataframes to the sheets of an xlsx file with xlsxwriter in its constant memory mode - every row is
+    flushed to a temporary file as soon as the next one starts. The header rows are formatted as by
+    pandas.DataFrame.to_excel.
+    """
+    workbook = xlsxwriter.Workbook(path_to_new_file, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    for df, sheet_name in zip(dataframes, sheet_names):
+        worksheet = workbook.add_worksheet(sheet_name)
+        if wide_columns:
+            for col_idx, column_name in enumerate(df.columns):
+                worksheet.set_column(col_idx, col_idx, estimate_column_width(df.iloc[:, col_idx], column_name))
+        worksheet.write_row(0, 0, list(df.columns), header_format)
+        row_idx = 1
+        for row_lst in dataframe_row_chunks(df):
+            for row in row_lst:
+                worksheet.write_row(row_idx, 0, row)
+                row_idx += 1
+    workbook.close()
+
+
+ODS_MIMETYPE = "application/vnd.oasis.opendocument.spreadsheet"
+ODS_MANIFEST = \
+    '<?xml version="1.0" encoding="UTF-8"?>\n' \
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">' \
+    '<manifest:file-entry manifest:full-path="/" manifest:media-type="{}"/>' \
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>' \
+    '</manifest:manifest>'.format(ODS_MIMETYPE)
+
+
+def write_ods_stream(dataframes: List[pd.DataFrame], sheet_names: List[str], path_to_new_file: str):
+    """
+    Writes the dataframes to the sheets of an ods file, streaming the content XML into the (zip) package chunk by
+    chunk rather than building a document tree of all the cells. Numbers are written as float cells, booleans as
+    boolean cells, missing values as empty cells, and anything else as text.
+    """
+    with zipfile.ZipFile(path_to_new_file, "w") as ods_zip:
+        ods_zip.writestr(zipfile.ZipInfo("mimetype"), ODS_MIMETYPE)  # first, and uncompressed (as the format requires)
+        ods_zip.writestr("META-INF/manifest.xml", ODS_MANIFEST, compress_type=zipfile.ZIP_DEFLATED)
+        content_info = zipfile.ZipInfo("content.xml")
+        content_info.compress_type = zipfile.ZIP_DEFLATED
+        with ods_zip.open(content_info, "w", force_zip64=True) as content:
+            content.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<office:document-content xmlns:office="{office}" xmlns:table="{table}" xmlns:text="{text}" '
+                          'office:version="1.2"><office:body><office:spreadsheet>'.format(**ODS_NAMESPACES).encode())
+            for df, sheet_name in zip(dataframes, sheet_names):
+                content.write('<table:table table:name={}><table:table-column table:number-columns-repeated="{}"/>'
+                              .format(quoteattr(sheet_name), max(df.shape[1], 1)).encode())
+                content.write(ods_row_xml(list(df.columns)).encode())
+                for row_lst in dataframe_row_chunks(df):
+                    content.write("".join(map(ods_row_xml, row_lst)).encode())
+                content.write(b'</table:table>')
+            content.write(b'</office:spreadsheet></office:body></office:document-content>')
+
+
+def ods_row_xml(values) -> str:
+    """
+    :param values: a sequence of python values (c.f. write_ods_stream for the cell type of each value)
+    :return: the XML of an ods table row
+    """
+    cell_lst = []
+    for value in values:
+        if value is None:
+            cell_lst.append('<table:table-cell/>')
+        elif isinstance(value, bool):
+            cell_lst.append('<table:table-cell office:value-type="boolean" office:boolean-value="{}">'
+                            '<text:p>{}</text:p></table:table-cell>'.format(str(value).lower(), value))
+        elif isinstance(value, (int, float)):
+            cell_lst.append('<table:table-cell office:value-type="float" office:value="{0!r}">'
+                            '<text:p>{0!r}</text:p></table:table-cell>'.format(value))
+        else:
+            cell_lst.append('<table:table-cell office:value-type="string">{}</table:table-cell>'.format(
+                "".join("<text:p>{}</text:p>".format(xml_escape(line)) for line in str(value).split("\n"))))
+    return '<table:table-row>{}</table:table-row>'.format("".join(cell_lst))
+
+
 def produce_weighted_risk_sheet(organization_df: pd.DataFrame, risk_df: pd.DataFrame,
                                 path_to_spreadsheet: str, institution: Institution):
     """
@@ -266,25 +696,21 @@ def produce_weighted_risk_sheet(organization_df: pd.DataFrame, risk_df: pd.DataF
     :param institution: Institution instance that contains information regarding the
                         weighted and the discounted risk factors of each person.
     """
-    weighted_risk_df = risk_df.copy()
-    rows, cols = weighted_risk_df.shape[0], weighted_risk_df.shape[1] + 3
-    for column in weighted_risk_df.columns[institution.num_risk_df_columns_that_arent_risk_factors:]:
-        weighted_risk_df.loc[:, column] = weighted_risk_df[column].apply(lambda x: float(x)) # important to change the type of the factor column to float, otherwise floats here will be rounded!
-    weighted_risk_df.insert(cols - 3, "Weighted Sum (risk)", rows*[0.0], False)
-    weighted_risk_df.insert(cols - 2, "Discount Factor (lambda)", rows * [0.0], False)
-    weighted_risk_df.insert(cols - 1, "Weighted and Discounted Sum (w=risk*lambda)", rows * [0.0], False)
-    # Iterate the organization dataframe, construct the person keys (by concatenating 4 personal details)
-    # Using the person keys, retrieve their information directly from the institution instance.
-    # Set the new information to the weighted_risk_df.
-    for rowid, organization_row in organization_df.iterrows():
-        person = "{}_{}_{}_{}".format(str(organization_row[0]),str(organization_row[1]),str(organization_row[2]),str(organization_row[3]))
-        weighted_risk_list = institution.nodes_attributes[person]['weighted_risk_vector'].tolist()
-        weighted_sum = institution.nodes_attributes[person]['r']
-        discount_factor = institution.nodes_attributes[person]['discount_factor']
-        weighted_and_discounted_sum = institution.nodes_attributes[person]['w']
-        new_data_list = weighted_risk_list + [weighted_sum, discount_factor, weighted_and_discounted_sum]
-        for colid, new_data in zip(range(institution.num_risk_df_columns_that_arent_risk_factors, cols), new_data_list):
-            weighted_risk_df.at[rowid, weighted_risk_df.columns[colid]] = new_data
+    # The people of the institution are ordered as the rows of the organization_df (and of the risk_df),
+    # hence the weighted risk sheet is assembled as a single block from the arrays of the institution.
+    num_details_columns = institution.num_risk_df_columns_that_arent_risk_factors
+    weighted_risk_df = pd.DataFrame(institution.weighted_risk_matrix.astype(np.float64), index=risk_df.index,
+                                    columns=risk_df.columns[num_details_columns:])
+    weighted_risk_df["Weighted Sum (risk)"] = institution.r.astype(np.float64)
+    weighted_risk_df["Discount Factor (lambda)"] = institution.discount_factor.astype(np.float64)
+    weighted_risk_df["Weighted and Discounted Sum (w=risk*lambda)"] = institution.w.astype(np.float64)
+    weighted_risk_df = pd.concat([risk_df.iloc[:, :num_details_columns], weighted_risk_df], axis=1)
+
+    # The spreadsheet is only rewritten if any of its sheets changed (a single sheet can't be replaced in place,
+    # the xlsx and ods files are zip packages). The digests of the written sheets are kept in the sidecar.
+    sheet_digests = [content_hash(df) for df in (organization_df, risk_df, weighted_risk_df)]
+    if read_main_spreadsheet_sheet_digests(path_to_spreadsheet) == sheet_digests:
+        return True, ""
 
     # Write weighted_risk_df as an additional sheet, alongside with the "organization_df" and the "risk_df" sheets
     try:
@@ -303,125 +729,115 @@ def produce_weighted_risk_sheet(organization_df: pd.DataFrame, risk_df: pd.DataF
 
 
     if write_succeeded:
+        # the organization and the risk sheets are the same, so the sidecar stays valid for the rewritten file
+        write_main_spreadsheet_sidecar(path_to_spreadsheet, organization_df, risk_df, sheet_digests)
         return True, ""
     else:
         return False, write_msg
 
 
-def merge_checklist_to_main(checklist_path: str, main_path: str, newmain_path: str) -> Tuple[bool, str]:
+def write_main_spreadsheet(organization_df: pd.DataFrame, risk_df: pd.DataFrame, path: str) -> Tuple[bool, str]:
+    """
+    Writes a main spreadsheet (the "Organization" and the "Risk" sheets) to a new file.
+    :return: True if the writing succeeded, and a message
     """
-    The merging of "checklist_path" spreadsheet into "main_path" spreadsheet stands
-    for updating the disease testing time of each person in the "main_path"
-    spreadsheet to be the date of the checklist file. The resulting main spreadsheet
-    is saved as a new file named "newmain_path".
+    try:
+        write_succeeded, write_msg = write_new_spreadsheet_to_file([organization_df, risk_df],
+                                                                   ["Organization", "Risk"],
+                                                                   path)
+    except PermissionError:
+        write_succeeded, write_msg = False, "Couldn't create the main spreadsheet due to lack of permission. " \
+                                            "It may be open by some other program. Try closing applications " \
+                                            "that may use the target spreadsheet, then retry."
+    except IOError:
+        write_succeeded, write_msg = False, "Couldn't create the main spreadsheet. "
+    return write_succeeded, write_msg
 
-    Note: If the checklist contains tested (marked with V) entries (people) that do
-     not appear in the main file, these entries will be ignored. Namely, these
-     entries will not be added to the newly created main spreadsheet (newmain_path)
 
-    :param checklist_path:
-    :param main_path:
-    :param newmain_path:
-    :return: True If at least the reading of the existing spreadsheets succeeded.
-    At this point this function cannot indicate whether the writing of the new
-    spreadsheet succeeded.
+def record_checklists_to_journal(checklist_path_lst: List[str], journal: TestJournal,
+                                 num_workers: int = None) -> Tuple[bool, str]:
     """
-    organization_df, risk_df, errmsg = read_main_spreadsheet(main_path)
-    if errmsg != "":
-        assert organization_df is None and risk_df is None
-        return False, errmsg
-    checklist_df = read_checklist_spreadsheet(checklist_path)  # containing only people that were checked
-    if checklist_df is None:
-        return False, "Failed loading the checklist from " + checklist_path
-    else:
-        assert checklist_df is not None and organization_df is not None and risk_df is not None
-        checklist_date = MyDate(strdate=checklist_path.split(os.path.sep)[-1].split("_")[0])
-        suspicious_checklist_entries_df = checklist_df.loc[~checklist_df[checklist_df.columns[0]].isin(risk_df[risk_df.columns[0]])]  # appear in checklist but not in the main df
-        errmsg = ""
-        if len(suspicious_checklist_entries_df) > 0:
-            errmsg = "Warning: the checklist {} contained the following entries that do not "\
-                  "appear in the main file {}. These entries were NOT added to {}. If you want " \
-                  "them to be included in the main file, you need to remove {}, add " \
-                     "these people to {} and then re-run this program. " \
-                     "\n".format(checklist_path, main_path, newmain_path, newmain_path, main_path)
-            errmsg += str(suspicious_checklist_entries_df)
-
-        # Update the people that appear both in the risk_df and in the checklist_df to have the checklist's test date
-        covid_test_col_str = 'Date of last COVID19 test' if 'Date of last COVID19 test' in risk_df.columns else 'תאריך בדיקה אחרון'
-        risk_df.loc[risk_df[risk_df.columns[0]].isin(checklist_df[checklist_df.columns[0]]),covid_test_col_str] = checklist_date.strdate
-        try:
-            write_succeeded, write_msg = write_new_spreadsheet_to_file([organization_df, risk_df],
-                                                                       ["Organization", "Risk"],
-                                                                       newmain_path)
-        except PermissionError:
-            write_succeeded, write_msg = False, "Couldn't create the main spreadsheet due to lack of permission. " \
-                                                "It may be open by some other program. Try closing applications " \
-                                                "that may use the target spreadsheet, then retry."
-        except IOError:
-            write_succeeded, write_msg = False, "Couldn't create the main spreadsheet. "
-
-        if write_succeeded:
-            return True, errmsg + '\n' + write_msg
-        else:
-            return False, write_msg
+    Logs the people that were checked in the "checklist_path_lst" spreadsheets into the journal as tested at the dates
+    of the checklists. Only the checklists that changed since they were last logged are read (in parallel threads),
+    and they are logged at once.
+    :param checklist_path_lst: paths to checklist spreadsheets, named <date>_checklist.<extension>
+    :param journal: TestJournal
+    :param num_workers: maximal number of threads reading the checklists (None --> the default of ThreadPoolExecutor)
+    :return: True If all the checklists are logged, and an error message otherwise
+    """
+    checklist_lst = []
+    for checklist_path in checklist_path_lst:
+        checklist_date = MyDate(strdate=os.path.basename(checklist_path).split("_")[0])
+        stat = os.stat(checklist_path)
+        fingerprint = "{}:{}".format(stat.st_mtime_ns, stat.st_size)
+        if journal.checklist_fingerprint(checklist_date) != fingerprint:
+            checklist_lst.append((checklist_path, checklist_date, fingerprint))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        # containing only people that were checked
+        checklist_df_lst = list(executor.map(read_checklist_spreadsheet,
+                                             [checklist_path for checklist_path, _, _ in checklist_lst]))
+    failed_checklist_path_lst = [checklist_path for (checklist_path, _, _), checklist_df
+                                 in zip(checklist_lst, checklist_df_lst) if checklist_df is None]
+    if len(failed_checklist_path_lst) > 0:
+        return False, "Failed loading the checklist from " + ", ".join(failed_checklist_path_lst)
+    journal.record_checklists([(checklist_date, checklist_df[checklist_df.columns[0]].tolist(), fingerprint)
+                               for (_, checklist_date, fingerprint), checklist_df in zip(checklist_lst,
+                                                                                        checklist_df_lst)])
+    return True, ""
 
 
-def set_up_main_spreadsheet(current_date: MyDate, previous_date: MyDate, spreadsheet_directory: str,
-                            spreadsheet_filename_extension: str):
-    """
-    Assume we are using spreadsheet_filename_extension="xlsx":
+DATED_SPREADSHEET_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})_(main|checklist)\.(xlsx|odt)$")  # c.f. list_dated_spreadsheets
 
-    If <current_date>_main.xlsx exists : just report that you are about to use the current version of
-                                         <current_date>_main.xlsx return True
-    If <current_date>_main.xlsx doesn't exist :
-        If <previous_date>_main.xlsx exists :
-            If <previous_date>_checklist.xlsx exists : <current_date>_main.xlsx = <previous_date>_checklist.xlsx +
-                                                                                  <previous_date>_main.xlsx
-            If <previous_date>_checklist.xlsx doesn't exist : <current_date>_main.xlsx = <previous_date>_main.xlsx
-        If <previous_date>_main.xlsx doesn't exist : "Error!" return False
 
-    :param current_date: MyDate object
-    :param previous_date: MyDate object
+def list_dated_spreadsheets(spreadsheet_directory: str, kind: str) -> Dict[str, List[str]]:
+    """
+    Lists the spreadsheets of a kind in a directory, by their dates.
     :param spreadsheet_directory: str, a path to the directory that contains all the "main" and "checklist" spreadsheets
-    :param spreadsheet_filename_extension: str, an extension (c.f. "xlsx" or "ods")
-
-    :return: string with the full path to the new spreadsheet <--> <current_date>_main.xlsx is ready for use
-             None <---> there was a problem setting up the main spreadsheet
-    """
-    current_main_filepath = os.path.join(spreadsheet_directory, "{}_main.{}".format(current_date.strdate,
-                                                                                    spreadsheet_filename_extension))
-    previous_main_filepath = os.path.join(spreadsheet_directory, "{}_main.{}".format(previous_date.strdate,
-                                                                                     spreadsheet_filename_extension))
-    previous_checklist_filepath = os.path.join(spreadsheet_directory,
-                                               "{}_checklist.{}".format(previous_date.strdate,
-                                                                        spreadsheet_filename_extension))
-
-    if not os.path.exists(spreadsheet_directory):
-        print("Error: directory {} doesn't exist. Make sure you create it and "
-              "place an initial spreadsheet there.".format(spreadsheet_directory))
-        return None
-    elif os.path.exists(current_main_filepath):
-        print("Found {}, solving optimum people selection based on this file solely.".format(current_main_filepath))
-        return current_main_filepath
-    elif os.path.exists(previous_main_filepath):
-        if os.path.exists(previous_checklist_filepath):
-            print("Merging {} into {} and saving the result as {}".format(previous_checklist_filepath,
-                                                                          previous_main_filepath,
-                                                                          current_main_filepath))
-            merge_succeeded, _ = merge_checklist_to_main(checklist_path=previous_checklist_filepath,
-                                                         main_path=previous_main_filepath,
-                                                         newmain_path=current_main_filepath)
-            return current_main_filepath if merge_succeeded else None
-        else:
-            print("While attempting to create the missing current main spreadsheet, the required file {} was not "
-                  "found. Hence, the current main spreadsheet ({}) will be just an exact copy of "
-                  "{}".format(previous_checklist_filepath, current_main_filepath, previous_main_filepath))
-            copyfile(previous_main_filepath, current_main_filepath)
-            return current_main_filepath
-    else:  # the previous main spreadsheet doesn't exist
-        print("Neither the current main spreadsheet ({}) nor the previous main spreadsheet ({})"
-              " were found. Cannot proceed.".format(current_main_filepath, previous_main_filepath))
-        return None
+    :param kind: "main" or "checklist"
+    :return: a dictionary from a date string to the list of paths of the <date>_<kind>.<xlsx|odt> spreadsheets
+    """
+    path_dict = {}
+    for filename in sorted(os.listdir(spreadsheet_directory)):
+        match = DATED_SPREADSHEET_PATTERN.match(filename)
+        if match is not None and match.group(2) == kind:
+            path_dict.setdefault(match.group(1), []).append(os.path.join(spreadsheet_directory, filename))
+    return path_dict
+
+
+def read_deferred_main_spreadsheet(main_date: MyDate, journal: TestJournal) -> Tuple[Union[pd.DataFrame, None],
+                                                                                    Union[pd.DataFrame, None],
+                                                                                    str, str]:
+    """
+    Produces the dataframes of a main spreadsheet whose writing was deferred (c.f. TestJournal.defer_main): the main
+    spreadsheet it is based on is read, and the date of the last test of each person is updated by the tests that
+    were logged in the journal since the date of that spreadsheet.
+    Note: tested people of the journal that do not appear in the main spreadsheet are ignored (and reported).
+    :param main_date: the date of the deferred main spreadsheet
+    :param journal: TestJournal
+    :return: organization_df, risk_df, error message (same as read_main_spreadsheet), and a warning message
+    """
+    base_path = journal.deferred_main_base(main_date)
+    if base_path is None:
+        return None, None, "The main spreadsheet of {} wasn't found.".format(main_date), ""
+    organization_df, risk_df, errmsg = read_main_spreadsheet(base_path)
+    if errmsg != "":
+        return None, None, errmsg, ""
+    base_date = MyDate(strdate=os.path.basename(base_path).split("_")[0])
+    latest_test_date_dict = journal.latest_test_dates(base_date, main_date)
+    worker_id_column = risk_df[risk_df.columns[0]]
+    latest_test_date = worker_id_column.map(latest_test_date_dict)
+    tested_mask = latest_test_date.notna()
+    covid_test_col_str = 'Date of last COVID19 test' if 'Date of last COVID19 test' in risk_df.columns else 'תאריך בדיקה אחרון'
+    risk_df.loc[tested_mask, covid_test_col_str] = latest_test_date[tested_mask]
+
+    warnmsg = ""
+    unknown_worker_id_lst = sorted(set(latest_test_date_dict) - set(worker_id_column))
+    if len(unknown_worker_id_lst) > 0:
+        warnmsg = "Warning: the checklists since {} contained the following tested entries (worker IDs) that do " \
+                  "not appear in the main file {}. These entries were ignored. If you want them to be included, " \
+                  "you need to add these people to {} and then re-run this program.\n{}".format(
+                      base_date, base_path, base_path, unknown_worker_id_lst)
+    return organization_df, risk_df, "", warnmsg
 
 
 def produce_checklist(sampled_person_lst: list, current_date: MyDate, spreadsheet_directory: str,